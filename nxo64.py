@@ -11,438 +11,23 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE
 # OR PERFORMANCE OF THIS SOFTWARE.
 
-# nxo64.py: IDA loader (and library for reading nso/nro files)
+# nxo64.py: IDA loader for nso/nro files; the parsing is done by nxolib.py
 
-import gzip, math, os, re, struct, sys
+# IDA runs every loader from source to ask it about every file it opens, so
+# this file only checks the header: nxolib is imported once there is a Switch
+# binary to load
+import os, sys
 
-from io import BytesIO
-from cStringIO import StringIO
-
-import lz4.block
-
-uncompress = lz4.block.decompress
-
-class BinFile(object):
-    def __init__(self, li):
-        self._f = li
-
-    def read(self, arg):
-        if isinstance(arg, str):
-            fmt = '<' + arg
-            size = struct.calcsize(fmt)
-            raw = self._f.read(size)
-            out = struct.unpack(fmt, raw)
-            if len(out) == 1:
-                return out[0]
-            return out
-        elif arg is None:
-            return self._f.read()
-        else:
-            out = self._f.read(arg)
-            return out
-
-    def read_from(self, arg, offset):
-        old = self.tell()
-        try:
-            self.seek(offset)
-            out = self.read(arg)
-        finally:
-            self.seek(old)
-        return out
-
-    def seek(self, off):
-        self._f.seek(off)
-
-    def close(self):
-        self._f.close()
-
-    def tell(self):
-        return self._f.tell()
-
-
-(DT_NULL, DT_NEEDED, DT_PLTRELSZ, DT_PLTGOT, DT_HASH, DT_STRTAB, DT_SYMTAB, DT_RELA, DT_RELASZ,
- DT_RELAENT, DT_STRSZ, DT_SYMENT, DT_INIT, DT_FINI, DT_SONAME, DT_RPATH, DT_SYMBOLIC, DT_REL,
- DT_RELSZ, DT_RELENT, DT_PLTREL, DT_DEBUG, DT_TEXTREL, DT_JMPREL, DT_BIND_NOW, DT_INIT_ARRAY,
- DT_FINI_ARRAY, DT_INIT_ARRAYSZ, DT_FINI_ARRAYSZ, DT_RUNPATH, DT_FLAGS) = xrange(31)
-DT_GNU_HASH = 0x6ffffef5
-DT_VERSYM = 0x6ffffff0
-DT_RELACOUNT = 0x6ffffff9
-DT_RELCOUNT = 0x6ffffffa
-DT_FLAGS_1 = 0x6ffffffb
-DT_VERDEF = 0x6ffffffc
-DT_VERDEFNUM = 0x6ffffffd
-
-STT_NOTYPE = 0
-STT_OBJECT = 1
-STT_FUNC = 2
-STT_SECTION = 3
-
-STB_LOCAL = 0
-STB_GLOBAL = 1
-STB_WEAK = 2
-
-R_ARM_ABS32 = 2
-R_ARM_TLS_DESC = 13
-R_ARM_GLOB_DAT = 21
-R_ARM_JUMP_SLOT = 22
-R_ARM_RELATIVE = 23
-
-R_AARCH64_ABS64 = 257
-R_AARCH64_GLOB_DAT = 1025
-R_AARCH64_JUMP_SLOT = 1026
-R_AARCH64_RELATIVE = 1027
-R_AARCH64_TLSDESC = 1031
-
-MULTIPLE_DTS = set([DT_NEEDED])
-
-
-class Range(object):
-    def __init__(self, start, size):
-        self.start = start
-        self.size = size
-        self.end = start+size
-        self._inclend = start+size-1
-
-    def overlaps(self, other):
-        return self.start <= other._inclend and other.start <= self._inclend
-
-    def includes(self, other):
-        return other.start >= self.start and other._inclend <= self._inclend
-
-    def __repr__(self):
-        return 'Range(0x%X -> 0x%X)' % (self.start, self.end)
-
-
-class Segment(object):
-    def __init__(self, r, name, kind):
-        self.range = r
-        self.name = name
-        self.kind = kind
-        self.sections = []
-
-    def add_section(self, s):
-        for i in self.sections:
-            assert not i.range.overlaps(s.range), '%r overlaps %r' % (s, i)
-        self.sections.append(s)
-
-
-class Section(object):
-    def __init__(self, r, name):
-        self.range = r
-        self.name = name
-
-    def __repr__(self):
-        return 'Section(%r, %r)' % (self.range, self.name)
-
-
-def suffixed_name(name, suffix):
-    if suffix == 0:
-        return name
-    return '%s.%d' % (name, suffix)
-
-
-class SegmentBuilder(object):
-    def __init__(self):
-        self.segments = []
-
-    def add_segment(self, start, size, name, kind):
-        r = Range(start, size)
-        for i in self.segments:
-            assert not r.overlaps(i.range)
-        self.segments.append(Segment(r, name, kind))
-
-    def add_section(self, name, start, end=None, size=None):
-        assert end is None or size is None
-        if size is None:
-            size = end-start
-        assert size > 0
-        r = Range(start, size)
-        for i in self.segments:
-            if i.range.includes(r):
-                i.add_section(Section(r, name))
-                return
-        assert False, "no containing segment for %r" % (name,)
-
-    def flatten(self):
-        self.segments.sort(key=lambda s: s.range.start)
-        parts = []
-        for segment in self.segments:
-            suffix = 0
-            segment.sections.sort(key=lambda s: s.range.start)
-            pos = segment.range.start
-            for section in segment.sections:
-                if pos < section.range.start:
-                    parts.append((pos, section.range.start, suffixed_name(segment.name, suffix), segment.kind))
-                    suffix += 1
-                    pos = section.range.start
-                parts.append((section.range.start, section.range.end, section.name, segment.kind))
-                pos = section.range.end
-            if pos < segment.range.end:
-                parts.append((pos, segment.range.end, suffixed_name(segment.name, suffix), segment.kind))
-                suffix += 1
-                pos = segment.range.end
-        return parts
-
-
-class ElfSym(object):
-    def __init__(self, name, info, other, shndx, value, size):
-        self.name = name
-        self.shndx = shndx
-        self.value = value
-        self.size = size
-
-        self.vis = other & 3
-        self.type = info & 0xF
-        self.bind = info >> 4
-
-    def __repr__(self):
-        return 'Sym(name=%r, shndx=0x%X, value=0x%X, size=0x%X, vis=%r, type=%r, bind=%r)' % (
-            self.name, self.shndx, self.value, self.size, self.vis, self.type, self.bind)
-
-
-class NxoFileBase(object):
-    def __init__(self, f, tloc, tsize, rloc, rsize, dloc, dsize):
-        self.textoff    = tloc
-        self.textsize   = tsize
-        self.rodataoff  = rloc
-        self.rodatasize = rsize
-        self.dataoff    = dloc
-        flatsize = dloc + dsize
-
-
-        self.binfile = f
-
-        # read MOD
-        self.modoff = f.read_from('I', 4)
-
-        f.seek(self.modoff)
-        if f.read('4s') != 'MOD0':
-            raise NxoException('invalid MOD0 magic')
-
-        self.dynamicoff = self.modoff + f.read('i')
-        self.bssoff     = self.modoff + f.read('i')
-        self.bssend     = self.modoff + f.read('i')
-        self.unwindoff  = self.modoff + f.read('i')
-        self.unwindend  = self.modoff + f.read('i')
-        self.moduleoff  = self.modoff + f.read('i')
-
-
-        self.datasize = self.bssoff - self.dataoff
-        self.bsssize = self.bssend - self.bssoff
-
-
-        self.segment_builder = builder = SegmentBuilder()
-        for off,sz,name,kind in [
-            (self.textoff, self.textsize, ".text", "CODE"),
-            (self.rodataoff, self.rodatasize, ".rodata", "CONST"),
-            (self.dataoff, self.datasize, ".data", "DATA"),
-            (self.bssoff, self.bsssize, ".bss", "BSS"),
-        ]:
-            builder.add_segment(off, sz, name, kind)
-
-        # read dynamic
-        self.armv7 = (f.read_from('Q', self.dynamicoff) > 0xFFFFFFFF or f.read_from('Q', self.dynamicoff+0x10) > 0xFFFFFFFF)
-        self.offsize = 4 if self.armv7 else 8
-
-        f.seek(self.dynamicoff)
-        self.dynamic = dynamic = {}
-        for i in MULTIPLE_DTS:
-            dynamic[i] = []
-        for i in xrange((flatsize - self.dynamicoff) / 0x10):
-            tag, val = f.read('II' if self.armv7 else 'QQ')
-            if tag == DT_NULL:
-                break
-            if tag in MULTIPLE_DTS:
-                dynamic[tag].append(val)
-            else:
-                dynamic[tag] = val
-        builder.add_section('.dynamic', self.dynamicoff, end=f.tell())
-
-        # read .dynstr
-        if DT_STRTAB in dynamic and DT_STRSZ in dynamic:
-            f.seek(dynamic[DT_STRTAB])
-            self.dynstr = f.read(dynamic[DT_STRSZ])
-        else:
-            self.dynstr = '\0'
-            print 'warning: no dynstr'
-
-        for startkey, szkey, name in [
-            (DT_STRTAB, DT_STRSZ, '.dynstr'),
-            (DT_INIT_ARRAY, DT_INIT_ARRAYSZ, '.init_array'),
-            (DT_FINI_ARRAY, DT_FINI_ARRAYSZ, '.fini_array'),
-            (DT_RELA, DT_RELASZ, '.rela.dyn'),
-            (DT_REL, DT_RELSZ, '.rel.dyn'),
-            (DT_JMPREL, DT_PLTRELSZ, ('.rel.plt' if self.armv7 else '.rela.plt')),
-        ]:
-            if startkey in dynamic and szkey in dynamic:
-                builder.add_section(name, dynamic[startkey], size=dynamic[szkey])
-
-        self.needed = [self.get_dynstr(i) for i in self.dynamic[DT_NEEDED]]
-
-        # load .dynsym
-        self.symbols = symbols = []
-        f.seek(dynamic[DT_SYMTAB])
-        while True:
-            if dynamic[DT_SYMTAB] < dynamic[DT_STRTAB] and f.tell() >= dynamic[DT_STRTAB]:
-                break
-            if self.armv7:
-                st_name, st_value, st_size, st_info, st_other, st_shndx = f.read('IIIBBH')
-            else:
-                st_name, st_info, st_other, st_shndx, st_value, st_size = f.read('IBBHQQ')
-            if st_name > len(self.dynstr):
-                break
-            symbols.append(ElfSym(self.get_dynstr(st_name), st_info, st_other, st_shndx, st_value, st_size))
-        builder.add_section('.dynsym', dynamic[DT_SYMTAB], end=f.tell())
-
-        self.plt_entries = []
-        self.relocations = []
-        locations = set()
-        if DT_REL in dynamic:
-            locations |= self.process_relocations(f, symbols, dynamic[DT_REL], dynamic[DT_RELSZ])
-
-        if DT_RELA in dynamic:
-            locations |= self.process_relocations(f, symbols, dynamic[DT_RELA], dynamic[DT_RELASZ])
-
-        if DT_JMPREL in dynamic:
-            pltlocations = self.process_relocations(f, symbols, dynamic[DT_JMPREL], dynamic[DT_PLTRELSZ])
-            locations |= pltlocations
-
-            plt_got_start = min(pltlocations)
-            plt_got_end = max(pltlocations) + self.offsize
-            if DT_PLTGOT in dynamic:
-                builder.add_section('.got.plt', dynamic[DT_PLTGOT], end=plt_got_end)
-
-            if not self.armv7:
-                f.seek(0)
-                text = f.read(self.textsize)
-                last = 12
-                while True:
-                    pos = text.find(struct.pack('<I', 0xD61F0220), last)
-                    if pos == -1: break
-                    last = pos+1
-                    if (pos % 4) != 0: continue
-                    off = pos - 12
-                    a, b, c, d = struct.unpack_from('<IIII', text, off)
-                    if d == 0xD61F0220 and (a & 0x9f00001f) == 0x90000010 and (b & 0xffe003ff) == 0xf9400211:
-                        base = off & ~0xFFF
-                        immhi = (a >> 5) & 0x7ffff
-                        immlo = (a >> 29) & 3
-                        paddr = base + ((immlo << 12) | (immhi << 14))
-                        poff = ((b >> 10) & 0xfff) << 3
-                        target = paddr + poff
-                        if plt_got_start <= target < plt_got_end:
-                            self.plt_entries.append((off, target))
-                builder.add_section('.plt', min(self.plt_entries)[0], end=max(self.plt_entries)[0] + 0x10)
-
-            # try to find the ".got" which should follow the ".got.plt"
-            good = False
-            got_end = plt_got_end + self.offsize
-            while got_end in locations and (DT_INIT_ARRAY not in dynamic or got_end < dynamic[DT_INIT_ARRAY]):
-                good = True
-                got_end += self.offsize
-
-            if good:
-                builder.add_section('.got', plt_got_end, end=got_end)
-
-        self.sections = []
-        for start, end, name, kind in builder.flatten():
-            self.sections.append((start, end, name, kind))
-
-
-    def process_relocations(self, f, symbols, offset, size):
-        locations = set()
-        f.seek(offset)
-        relocsize = 8 if self.armv7 else 0x18
-        for i in xrange(size / relocsize):
-            # NOTE: currently assumes all armv7 relocs have no addends,
-            # and all 64-bit ones do.
-            if self.armv7:
-                offset, info = f.read('II')
-                addend = None
-                r_type = info & 0xff
-                r_sym = info >> 8
-            else:
-                offset, info, addend = f.read('QQq')
-                r_type = info & 0xffffffff
-                r_sym = info >> 32
-
-            sym = symbols[r_sym] if r_sym != 0 else None
-
-            if r_type != R_AARCH64_TLSDESC and r_type != R_ARM_TLS_DESC:
-                locations.add(offset)
-            self.relocations.append((offset, r_type, sym, addend))
-        return locations
-
-    def get_dynstr(self, o):
-        return self.dynstr[o:self.dynstr.index('\0', o)]
-
-
-class NsoFile(NxoFileBase):
-    def __init__(self, fileobj):
-        f = BinFile(fileobj)
-
-        if f.read_from('4s', 0) != 'NSO0':
-            raise NxoException('Invalid NSO magic')
-
-        toff, tloc, tsize = f.read_from('III', 0x10)
-        roff, rloc, rsize = f.read_from('III', 0x20)
-        doff, dloc, dsize = f.read_from('III', 0x30)
-
-        tfilesize, rfilesize, dfilesize = f.read_from('III', 0x60)
-        bsssize = f.read_from('I', 0x3C)
-
-        print 'load text: '
-        text = uncompress(f.read_from(tfilesize, toff), uncompressed_size=tsize)
-        ro   = uncompress(f.read_from(rfilesize, roff), uncompressed_size=rsize)
-        data = uncompress(f.read_from(dfilesize, doff), uncompressed_size=dsize)
-
-        full = text
-        if rloc >= len(full):
-            full += '\0' * (rloc - len(full))
-        else:
-            print 'truncating?'
-            full = full[:rloc]
-        full += ro
-        if dloc >= len(full):
-            full += '\0' * (dloc - len(full))
-        else:
-            print 'truncating?'
-            full = full[:dloc]
-        full += data
-
-        super(NsoFile, self).__init__(BinFile(StringIO(full)), tloc, tsize, rloc, rsize, dloc, dsize)
-
-
-class NroFile(NxoFileBase):
-    def __init__(self, fileobj):
-        f = BinFile(fileobj)
-
-        if f.read_from('4s', 0x10) != 'NRO0':
-            raise NxoException('Invalid NRO magic')
-
-        f.seek(0x20)
-
-        tloc, tsize = f.read('II')
-        rloc, rsize = f.read('II')
-        dloc, dsize = f.read('II')
-
-        super(NroFile, self).__init__(f, tloc, tsize, rloc, rsize, dloc, dsize)
-
-
-class NxoException(Exception):
-    pass
-
-
-def load_nxo(fileobj):
-    fileobj.seek(0)
-    header = fileobj.read(0x14)
 
+# a copy of nxolib.nxo_kind, so accept_file can answer without importing
+# nxolib for every file IDA opens
+def nxo_kind(header):
+    # 'NSO', 'NRO' or None from the first 0x14 bytes of a file
     if header[:4] == 'NSO0':
-        return NsoFile(fileobj)
-    elif header[0x10:0x14] == 'NRO0':
-        return NroFile(fileobj)
-    else:
-        raise NxoException("not an NRO or NSO file")
+        return 'NSO'
+    if header[0x10:0x14] == 'NRO0':
+        return 'NRO'
+    return None
 
 
 try:
@@ -452,15 +37,49 @@ except ImportError:
     pass
 else:
     # IDA specific code
+    EXEFS_FORMAT = 'nxo64.py: Switch ExeFS (every module in the directory)'
+
+    # files whose single-module format has been offered to IDA 7, which
+    # calls accept_file again for the ExeFS one
+    exefs_offered = set()
+
     def accept_file(li, n):
-        if not isinstance(n, (int,long)) or n == 0:
-            li.seek(0)
-            if li.read(4) == 'NSO0':
-                return 'nxo64.py: Switch binary (NSO)'
-            li.seek(0x10)
-            if li.read(4) == 'NRO0':
-                return 'nxo64.py: Switch binary (NRO)'
-        return 0
+        li.seek(0)
+        kind = nxo_kind(li.read(0x14))
+        if kind is None:
+            return 0
+        single = 'nxo64.py: Switch binary (%s)' % (kind,)
+        if isinstance(n, (int,long)):
+            # IDA 6 numbers the formats and calls until one returns 0
+            if n == 0:
+                return single
+            elif n == 1 and kind == 'NSO':
+                return EXEFS_FORMAT
+            return 0
+        # IDA 7 passes the file name and calls once more for every answer
+        # carrying ACCEPT_CONTINUE
+        if kind != 'NSO':
+            return single
+        if n in exefs_offered:
+            exefs_offered.discard(n)
+            return {'format': EXEFS_FORMAT, 'options': 1}
+        exefs_offered.add(n)
+        return {'format': single, 'options': 1 | idaapi.ACCEPT_CONTINUE}
+
+    def ida_library():
+        # IDA doesn't put the loaders directory on sys.path, so nxolib.py
+        # (next to this file) may need adding before the first import
+        try:
+            import nxolib
+        except ImportError:
+            dirs = [idaapi.idadir('loaders')]
+            if hasattr(idaapi, 'get_user_idadir'):
+                dirs.insert(0, os.path.join(idaapi.get_user_idadir(), 'loaders'))
+            if '__file__' in globals():
+                dirs.insert(0, os.path.dirname(os.path.abspath(__file__)))
+            sys.path.extend(path for path in dirs if path not in sys.path)
+            import nxolib
+        return nxolib
 
     def ida_make_offset(f, ea):
         if f.armv7:
@@ -469,42 +88,49 @@ else:
             idc.MakeQword(ea)
         idc.OpOff(ea, 0, 0)
 
-    def find_bl_targets(text_start, text_end):
-        targets = set()
-        for pc in range(text_start, text_end, 4):
-            d = Dword(pc)
-            if (d & 0xfc000000) == 0x94000000:
-                imm = d & 0x3ffffff
-                if imm & 0x2000000:
-                    imm |= ~0x1ffffff
-                if 0 <= imm <= 2:
-                    continue
-                target = pc + imm * 4
-                if target >= text_start and target < text_end:
-                    targets.add(target)
-        return targets
-
-    def load_file(li, neflags, format):
-        idaapi.set_processor_type("arm", SETPROC_ALL|SETPROC_FATAL)
-        f = load_nxo(li)
-        if f.armv7:
-            idc.SetShortPrm(idc.INF_LFLAGS, idc.GetShortPrm(idc.INF_LFLAGS) | idc.LFLG_PC_FLAT)
-        else:
-            idc.SetShortPrm(idc.INF_LFLAGS, idc.GetShortPrm(idc.INF_LFLAGS) | idc.LFLG_64BIT)
-
-        idc.SetCharPrm(idc.INF_DEMNAMES, idaapi.DEMNAM_GCC3)
-        idaapi.set_compiler_id(idaapi.COMP_GNU)
-        idaapi.add_til2('gnulnx_arm' if f.armv7 else 'gnulnx_arm64', 1)
-
-        loadbase = 0x60000000 if f.armv7 else 0x7100000000
-
-        f.binfile.seek(0)
-        as_string = f.binfile.read(f.bssoff)
-        idaapi.mem2base(as_string, loadbase)
+    def ida_enable_auto(enable):
+        # returns the previous state, or None where this IDA can't switch
+        # auto-analysis off
+        if hasattr(idaapi, 'enable_auto'):
+            return idaapi.enable_auto(enable)
+        return None
+
+    def ida_namer():
+        # set_name with SN_FORCE picks a unique name like do_name_anyway, but
+        # without the checks and warning dialogs
+        flags = getattr(idaapi, 'SN_FORCE', None)
+        if flags is None or not hasattr(idaapi, 'set_name'):
+            return idaapi.do_name_anyway
+        flags |= idaapi.SN_NOCHECK | idaapi.SN_NOWARN
+        set_name = idaapi.set_name
+        return lambda ea, name: set_name(ea, name, flags)
+
+    def ida_input_path():
+        if hasattr(idaapi, 'get_input_file_path'):
+            return idaapi.get_input_file_path()
+        return idc.GetInputFilePath()
+
+    def ida_add_image(nxos, index):
+        module, f, loadbase = nxos.modules[index]
+        stats = f.stats
+        stats.start()
+
+        # relocations are applied to the image up front, so it goes into the
+        # database in one piece
+        image = memoryview(nxos.relocated_image(index))
+        stats.lap('relocated_image')
+        try:
+            idaapi.mem2base(image, loadbase)
+        except TypeError:
+            # older IDAPython builds only take str here
+            idaapi.mem2base(image.tobytes(), loadbase)
+        stats.lap('ida.mem2base')
 
         for start, end, name, kind in f.sections:
             if name.startswith('.got'):
                 kind = 'CONST'
+            # modules loaded together get prefixed segment names ("sdk.text")
+            name = module + name
             idaapi.add_segm(0, loadbase+start, loadbase+end, name, kind)
             segm = idaapi.get_segm_by_name(name)
             if kind == 'CONST':
@@ -517,45 +143,36 @@ else:
                 segm.perm = idaapi.SEGPERM_READ | idaapi.SEGPERM_WRITE
             idaapi.update_segm(segm)
             idaapi.set_segm_addressing(segm, 1 if f.armv7 else 2)
+        stats.lap('ida.segments')
 
-        # do imports
-        # TODO: can we make imports show up in "Imports" window?
-        undef_count = 0
-        for s in f.symbols:
-            if not s.shndx and s.name:
-                undef_count += 1
-        last_ea = max(loadbase + end for start, end, name, kind in f.sections)
-        undef_entry_size = 8
-        undef_ea = ((last_ea + 0xFFF) & ~0xFFF) + undef_entry_size # plus 8 so we don't end up on the "end" symbol
-        idaapi.add_segm(0, undef_ea, undef_ea+undef_count*undef_entry_size, "UNDEF", "XTRN")
-        segm = idaapi.get_segm_by_name("UNDEF")
-        segm.type = idaapi.SEG_XTRN
-        idaapi.update_segm(segm)
+    def ida_add_symbols(nxos, index, funcs, set_name, counts):
+        from nxolib import (STT_FUNC, R_ARM_GLOB_DAT, R_ARM_JUMP_SLOT, R_ARM_ABS32, R_ARM_RELATIVE,
+                            R_AARCH64_GLOB_DAT, R_AARCH64_JUMP_SLOT, R_AARCH64_ABS64, R_AARCH64_RELATIVE)
+        module, f, loadbase = nxos.modules[index]
+        resolved = nxos.resolved[index]
+        stats = f.stats
+        stats.start()
+
+        add_entry = idaapi.add_entry
         for i,s in enumerate(f.symbols):
             if not s.shndx and s.name:
-                idc.MakeQword(undef_ea)
-                idaapi.do_name_anyway(undef_ea, s.name)
-                s.resolved = undef_ea
-                undef_ea += undef_entry_size
+                # named in the UNDEF segment, or by the module exporting it
+                counts['imports'] += 1
             elif i != 0:
                 assert s.shndx
-                s.resolved = loadbase + s.value
                 if s.name:
                     if s.type == STT_FUNC:
-                        print hex(s.resolved), s.name
-                        idaapi.add_entry(s.resolved, s.resolved, s.name, 0)
+                        add_entry(resolved[i], resolved[i], s.name, 0)
+                        counts['exported functions'] += 1
                     else:
-                        idaapi.do_name_anyway(s.resolved, s.name)
+                        set_name(resolved[i], s.name)
+                        counts['exported objects'] += 1
 
-            else:
-                # NULL symbol
-                s.resolved = 0
-
-        funcs = set()
         for s in f.symbols:
             if s.name and s.shndx and s.value:
                 if s.type == STT_FUNC:
                     funcs.add(loadbase+s.value)
+        stats.lap('ida.symbols')
 
         got_name_lookup = {}
         for offset, r_type, sym, addend in f.relocations:
@@ -564,31 +181,105 @@ else:
                 if not sym:
                     print 'error: relocation at %X failed' % target
                 else:
-                    idaapi.put_long(target, sym.resolved)
+                    got_name_lookup[offset] = sym.name
             elif r_type == R_ARM_RELATIVE:
-                idaapi.put_long(target, idaapi.get_long(target) + loadbase)
+                pass
             elif r_type in (R_AARCH64_GLOB_DAT, R_AARCH64_JUMP_SLOT, R_AARCH64_ABS64):
-                idaapi.put_qword(target, sym.resolved + addend)
                 if addend == 0:
                     got_name_lookup[offset] = sym.name
             elif r_type == R_AARCH64_RELATIVE:
-                idaapi.put_qword(target, loadbase + addend)
                 if addend < f.textsize:
                     funcs.add(loadbase + addend)
             else:
-                print 'TODO r_type %d' % (r_type,)
+                counts['unhandled relocations (type %d)' % (r_type,)] += 1
             ida_make_offset(f, target)
+        counts['relocations'] += len(f.relocations)
+        stats.lap('ida.relocations')
 
         for func, target in f.plt_entries:
             if target in got_name_lookup:
                 addr = loadbase + func
                 funcs.add(addr)
-                idaapi.do_name_anyway(addr, got_name_lookup[target])
+                set_name(addr, got_name_lookup[target])
+                counts['PLT entries'] += 1
+        stats.lap('ida.plt')
 
-        funcs |= find_bl_targets(loadbase, loadbase+f.textsize)
+        funcs.update(loadbase + i for i in f.find_bl_targets())
+        stats.lap('bl_targets')
 
-        for addr in sorted(funcs, reverse=True):
-            idc.AutoMark(addr, AU_CODE)
-            idc.AutoMark(addr, AU_PROC)
+        # unwind info gives exact bounds, so those functions need no guessing
+        starts, ends = f.unwind_functions
+        for start, end in zip(starts, ends):
+            if start < end <= f.textsize:
+                idaapi.add_func(loadbase + start, loadbase + end)
+                counts['unwind functions'] += 1
+        stats.lap('ida.unwind')
+
+    def load_file(li, neflags, format):
+        idaapi.set_processor_type("arm", SETPROC_ALL|SETPROC_FATAL)
+        nxolib = ida_library()
+        # NXO64_VERIFY=1 checks NSO segment hashes, printing any mismatches
+        verify = bool(os.environ.get('NXO64_VERIFY'))
+        nxos = None
+        if format == EXEFS_FORMAT:
+            try:
+                nxos = nxolib.load_exefs(os.path.dirname(ida_input_path()), verify=verify)
+            except nxolib.NxoException as e:
+                print 'warning: %s, loading just this module' % (e,)
+        if nxos is None:
+            nxos = nxolib.NxoSet([('', nxolib.load_nxo(li, nxolib.SEGMENT_WORKERS if verify else None, verify=verify))])
+
+        if nxos.armv7:
+            idc.SetShortPrm(idc.INF_LFLAGS, idc.GetShortPrm(idc.INF_LFLAGS) | idc.LFLG_PC_FLAT)
+        else:
+            idc.SetShortPrm(idc.INF_LFLAGS, idc.GetShortPrm(idc.INF_LFLAGS) | idc.LFLG_64BIT)
 
+        idc.SetCharPrm(idc.INF_DEMNAMES, idaapi.DEMNAM_GCC3)
+        idaapi.set_compiler_id(idaapi.COMP_GNU)
+        idaapi.add_til2('gnulnx_arm' if nxos.armv7 else 'gnulnx_arm64', 1)
+
+        # nothing gets analysed until everything has been written
+        auto = ida_enable_auto(False)
+        try:
+            set_name = ida_namer()
+
+            for i in xrange(len(nxos.modules)):
+                ida_add_image(nxos, i)
+
+            # do imports
+            # TODO: can we make imports show up in "Imports" window?
+            undef_ea = nxos.import_base
+            idaapi.add_segm(0, undef_ea, undef_ea+len(nxos.undefined)*nxos.import_size, "UNDEF", "XTRN")
+            segm = idaapi.get_segm_by_name("UNDEF")
+            segm.type = idaapi.SEG_XTRN
+            idaapi.update_segm(segm)
+            for addr, name in nxos.undefined:
+                idc.MakeQword(addr)
+                set_name(addr, name)
+
+            from collections import Counter
+            funcs = set()
+            for i, (module, f, loadbase) in enumerate(nxos.modules):
+                counts = Counter()
+                ida_add_symbols(nxos, i, funcs, set_name, counts)
+                print 'nxo64.py: %s at 0x%X: %s' % (module or 'module', loadbase,
+                                                   ', '.join('%d %s' % (counts[k], k) for k in sorted(counts)))
+
+            # AU_PROC makes code first, so one mark per function is enough
+            auto_mark = getattr(idaapi, 'auto_mark', None) or idc.AutoMark
+            for addr in sorted(funcs, reverse=True):
+                auto_mark(addr, AU_PROC)
+            print 'nxo64.py: %d undefined imports, %d function starts queued for analysis' % (len(nxos.undefined), len(funcs))
+        finally:
+            if auto is not None:
+                ida_enable_auto(auto)
+
+        if os.environ.get('NXO64_PROFILE'):
+            for module, f, loadbase in nxos.modules:
+                print module or 'module'
+                print f.stats.report()
         return 1
+
+if __name__ == '__main__':
+    from nxolib import main
+    main()
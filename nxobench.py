@@ -0,0 +1,261 @@
+# nxobench.py: wall-clock benchmarks for nxo64.py / nxolib.py, on real or synthetic modules
+
+import argparse, contextlib, os, struct, subprocess, sys, time
+
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import nxo64, nxogen, nxolib
+
+
+@contextlib.contextmanager
+def quiet():
+    # the loader prints progress; keep it out of the timings
+    old = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = old
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        with quiet():
+            func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def nso_jobs(blob):
+    toff, tloc, tsize = struct.unpack_from('<III', blob, 0x10)
+    roff, rloc, rsize = struct.unpack_from('<III', blob, 0x20)
+    doff, dloc, dsize = struct.unpack_from('<III', blob, 0x30)
+    tfilesize, rfilesize, dfilesize = struct.unpack_from('<III', blob, 0x60)
+    image = bytearray(dloc + dsize)
+    return [
+        (image, blob[toff:toff+tfilesize], 0, tsize, rloc),
+        (image, blob[roff:roff+rfilesize], rloc, rsize, dloc),
+        (image, blob[doff:doff+dfilesize], dloc, dsize, len(image)),
+    ]
+
+
+def decompress_sequential(jobs):
+    for args in jobs:
+        nxolib.decompress_segment(*args)
+
+
+def decompress_threaded(jobs, pool):
+    for result in [pool.apply_async(nxolib.decompress_segment, args) for args in jobs]:
+        result.get()
+
+
+def hash_sequential(jobs):
+    for image, compressed, loc, size, end in jobs:
+        nxolib.hash_segment(image, loc, size)
+
+
+def hash_threaded(jobs, pool):
+    for result in [pool.apply_async(nxolib.hash_segment, (image, loc, size))
+                   for image, compressed, loc, size, end in jobs]:
+        result.get()
+
+
+def load_all(blobs, workers=None, verify=False):
+    for blob in blobs:
+        nxolib.load_nxo(BytesIO(blob), workers=workers, cache=False, verify=verify)
+
+
+def load_all_parallel(blobs, workers=None):
+    nxolib.load_nxos([BytesIO(blob) for blob in blobs], workers=workers, cache=False)
+
+
+def query_metadata(blobs, lazy):
+    for blob in blobs:
+        f = nxolib.load_nxo(BytesIO(blob), lazy=lazy, cache=False)
+        f.needed, f.dynamic, len(f.symbols)
+
+
+def read_all(paths):
+    blobs = []
+    for path in paths:
+        with open(path, 'rb') as fileobj:
+            blobs.append(fileobj.read())
+    return blobs
+
+
+def synthetic(size, armv7=False, nro=False):
+    # a module with `size` MB of .text and tables scaled to match
+    module = nxogen.Module(exports=size * 256, imports=min(size * 16, 4096), relocs=size * 2048,
+                           text_size=size << 20, armv7=armv7)
+    out = BytesIO()
+    (nxogen.write_nro if nro else nxogen.write_nso)(out, module)
+    return out.getvalue()
+
+
+def full_load(blob, workers=None):
+    # everything load_file asks of the parser, outside IDA
+    stats = nxolib.LoadStats()
+    f = nxolib.load_nxo(BytesIO(blob), workers=workers, cache=False, stats=stats)
+    f.sections
+    with stats.phase('relocated_image'):
+        f.relocated_image(0, f.symbol_addresses(0, f.bssend))
+    with stats.phase('bl_targets'):
+        f.find_bl_targets()
+    return f.bssend, stats
+
+
+def peak_rss():
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def bench_throughput(names, blobs, repeat, workers):
+    mb = 1048576.0
+    print '%-32s %10s %10s %10s %10s %10s' % ('module', 'size', 'time', 'rate', 'buffers', 'peak rss')
+    for name, blob in zip(names, blobs):
+        best = None
+        for i in xrange(repeat):
+            with quiet():
+                size, stats = full_load(blob, workers)
+            total = sum(stats.times.values())
+            if best is None or total < best[0]:
+                best = total, stats
+        total, stats = best
+        print '%-32s %9.1fM %9.3fs %7.1fM/s %9.1fM %9.1fM' % (
+            name[-32:], size / mb, total, size / mb / total, sum(stats.peaks.values()) / mb, peak_rss() / mb)
+        for phase, elapsed in stats.times.items():
+            print '  %-30s %10s %9.3fs %7.1fM/s' % (phase, '', elapsed, size / mb / elapsed if elapsed else float('inf'))
+
+
+# run in a fresh interpreter: how long compiling and running a file takes the
+# way IDA runs a loader (from source, never from a .pyc), how many modules it
+# drags in and how much it grows the process
+STARTUP_SCRIPT = '''
+import resource, sys, time
+path = sys.argv[1]
+before = set(sys.modules)
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+with open(path) as fileobj:
+    exec compile(fileobj.read(), path, 'exec') in {'__name__': '__loader__'}
+elapsed = time.time() - start
+print elapsed, len(set(sys.modules) - before), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+'''
+
+
+def bench_startup(repeat):
+    # nxo64.py is run for every file IDA opens; nxolib.py only once a
+    # Switch binary is being loaded
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ('nxo64.py', 'nxolib.py'):
+        best = None
+        for i in xrange(max(repeat, 5)):
+            out = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT, name], cwd=here)
+            elapsed, modules, rss = out.split()
+            if best is None or float(elapsed) < best[0]:
+                best = float(elapsed), int(modules), int(rss)
+        elapsed, modules, rss = best
+        print '%-32s %9.1fms %10d %9dK' % ('run ' + name, elapsed * 1000, modules, rss)
+
+    header = BytesIO('\0' * 0x10 + 'NRO0' + '\0' * 0x100)
+    runs = 100000
+    start = time.time()
+    for i in xrange(runs):
+        header.seek(0)
+        nxo64.nxo_kind(header.read(0x14))
+    print '%-32s %9.2fus' % ('header check', (time.time() - start) / runs * 1e6)
+
+
+def bench_decompression(paths, blobs, repeat, workers):
+    pool = ThreadPool(workers)
+    row = '%-32s %-10s %9.1fM %9.3fs %9.3fs %7.2fx'
+    print '%-32s %-10s %10s %10s %10s %8s' % ('module', 'phase', 'size', 'sequential', 'threaded', 'speedup')
+    try:
+        for path, blob in zip(paths, blobs):
+            name = os.path.basename(path)[-32:]
+            jobs = nso_jobs(blob)
+            size = len(jobs[0][0]) / 1048576.0
+            seq = best_of(repeat, decompress_sequential, jobs)
+            par = best_of(repeat, decompress_threaded, jobs, pool)
+            print row % (name, 'decompress', size, seq, par, seq / par)
+            seq = best_of(repeat, hash_sequential, jobs)
+            par = best_of(repeat, hash_threaded, jobs, pool)
+            print row % (name, 'hash', size, seq, par, seq / par)
+            seq = best_of(repeat, load_all, [blob])
+            par = best_of(repeat, load_all, [blob], workers)
+            print row % (name, 'load', size, seq, par, seq / par)
+            seq = best_of(repeat, load_all, [blob], None, True)
+            par = best_of(repeat, load_all, [blob], workers, True)
+            print row % (name, 'verify', size, seq, par, seq / par)
+    finally:
+        pool.close()
+
+    if len(blobs) > 1:
+        seq = best_of(repeat, load_all, blobs)
+        par = best_of(repeat, load_all_parallel, blobs, workers)
+        size = sum(len(nso_jobs(blob)[0][0]) for blob in blobs) / 1048576.0
+        print row % ('(all %d together)' % len(blobs), 'load', size, seq, par, seq / par)
+
+
+def bench_metadata(paths, blobs, repeat):
+    row = '%-32s %9.3fs %9.3fs %7.2fx'
+    print '%-32s %10s %10s %8s' % ('module', 'full', 'lazy', 'speedup')
+    for path, blob in zip(paths, blobs):
+        full = best_of(repeat, query_metadata, [blob], False)
+        lazy = best_of(repeat, query_metadata, [blob], True)
+        print row % (os.path.basename(path)[-32:], full, lazy, full / lazy)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark NSO loading in nxolib.py')
+    parser.add_argument('paths', nargs='*', help='NSO / NRO files to load')
+    parser.add_argument('-s', '--synthetic', type=int, action='append', default=[], metavar='MB',
+                        help='also generate a module with this many MB of .text (repeatable)')
+    parser.add_argument('--armv7', action='store_true', help='generate 32-bit modules')
+    parser.add_argument('--nro', action='store_true', help='generate NROs instead of NSOs')
+    parser.add_argument('--startup', action='store_true', help='time running nxo64.py / nxolib.py from source and checking a header')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per measurement (best is reported)')
+    parser.add_argument('-j', '--workers', type=int, default=3, help='decompression threads')
+    args = parser.parse_args(argv)
+    if args.startup:
+        print '%-32s %11s %10s %10s' % ('startup', 'time', 'modules', 'rss')
+        bench_startup(args.repeat)
+        if not args.paths and not args.synthetic:
+            return
+        print
+    if not args.paths and not args.synthetic:
+        parser.error('give some files, --synthetic sizes or --startup')
+
+    names = list(args.paths)
+    blobs = read_all(args.paths)
+    for size in args.synthetic:
+        names.append('synthetic-%dM.%s' % (size, 'nro' if args.nro else 'nso'))
+        blobs.append(synthetic(size, args.armv7, args.nro))
+
+    bench_throughput(names, blobs, args.repeat, args.workers)
+
+    nsos = [(name, blob) for name, blob in zip(names, blobs) if blob[:4] == 'NSO0']
+    if nsos:
+        names, blobs = zip(*nsos)
+        print
+        bench_decompression(names, blobs, args.repeat, args.workers)
+        print
+        bench_metadata(names, blobs, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# nxodiff.py: what changed between two versions of an NSO / NRO (or two
+# directories of them, paired by relative path), as one JSON line per module
+
+import argparse, json, multiprocessing, os, sys
+
+import nxolib
+
+
+def merge(old, new):
+    # walk two lists of (key, value) sorted by key in step, yielding
+    # (key, old value, new value) with None for the side that lacks the key
+    i = j = 0
+    while i < len(old) or j < len(new):
+        if j == len(new) or (i < len(old) and old[i][0] < new[j][0]):
+            yield old[i][0], old[i][1], None
+            i += 1
+        elif i == len(old) or new[j][0] < old[i][0]:
+            yield new[j][0], None, new[j][1]
+            j += 1
+        else:
+            yield old[i][0], old[i][1], new[j][1]
+            i += 1
+            j += 1
+
+
+def run_lengths(keys):
+    # sorted keys as (key, times it occurs) pairs
+    out = []
+    for key in keys:
+        if out and out[-1][0] == key:
+            out[-1][1] += 1
+        else:
+            out.append([key, 1])
+    return out
+
+
+def exports(f):
+    # sorted (name, (value, size)) for the module's defined symbols
+    symbols = f.symbols
+    out = []
+    for i in xrange(1, len(symbols)):
+        if symbols.shndxs[i]:
+            name = symbols.name(i)
+            if name:
+                out.append((name, (symbols.values[i], symbols.sizes[i])))
+    out.sort()
+    return out
+
+
+def imports(f):
+    symbols = f.symbols
+    names = set(symbols.name(i) for i in xrange(1, len(symbols)) if not symbols.shndxs[i])
+    names.discard('')
+    return [(name, True) for name in sorted(names)]
+
+
+def symbol_relocations(f):
+    # sorted ((symbol name, R_* name), count) over relocations that name a symbol
+    symbols = f.symbols
+    reloc_names = f.relocation_names()
+    names = {}
+    keys = []
+    for table in f.relocation_tables:
+        for r_type, r_sym in zip(table.types, table.syms):
+            if r_sym:
+                if r_sym not in names:
+                    names[r_sym] = symbols.name(r_sym)
+                keys.append((names[r_sym], reloc_names.get(r_type, str(r_type))))
+    keys.sort()
+    return run_lengths(keys)
+
+
+def section_sizes(f):
+    return sorted((name, end - start) for start, end, name, kind in f.sections)
+
+
+def diff_nxo(old, new):
+    # a JSON-friendly description of how module `new` differs from `old`;
+    # empty lists and dicts mean nothing of that kind changed
+    out = {'exports': {'added': [], 'removed': [], 'moved': []}, 'imports': {'added': [], 'removed': []}}
+
+    for name, before, after in merge(exports(old), exports(new)):
+        if before is None:
+            out['exports']['added'].append({'name': name, 'value': after[0], 'size': after[1]})
+        elif after is None:
+            out['exports']['removed'].append({'name': name, 'value': before[0], 'size': before[1]})
+        elif before != after:
+            out['exports']['moved'].append({'name': name, 'old_value': before[0], 'new_value': after[0],
+                                            'old_size': before[1], 'new_size': after[1]})
+
+    for name, before, after in merge(imports(old), imports(new)):
+        if before is None:
+            out['imports']['added'].append(name)
+        elif after is None:
+            out['imports']['removed'].append(name)
+
+    out['needed'] = {'added': [name for name in new.needed if name not in old.needed],
+                     'removed': [name for name in old.needed if name not in new.needed]}
+
+    out['sections'] = []
+    for name, before, after in merge(section_sizes(old), section_sizes(new)):
+        if before != after:
+            out['sections'].append({'name': name, 'old_size': before, 'new_size': after,
+                                    'delta': (after or 0) - (before or 0)})
+
+    out['relocations'] = {}
+    old_counts, new_counts = old.relocation_counts(), new.relocation_counts()
+    for name in sorted(set(old_counts) | set(new_counts)):
+        before, after = old_counts.get(name, 0), new_counts.get(name, 0)
+        if before != after:
+            out['relocations'][name] = after - before
+
+    out['symbol_relocations'] = []
+    for (name, r_type), before, after in merge(symbol_relocations(old), symbol_relocations(new)):
+        if before != after:
+            out['symbol_relocations'].append({'symbol': name, 'type': r_type, 'delta': (after or 0) - (before or 0)})
+
+    if old.armv7 != new.armv7:
+        out['armv7'] = {'old': old.armv7, 'new': new.armv7}
+    return out
+
+
+def diff_files(old_path, new_path):
+    with open(old_path, 'rb') as fileobj:
+        old = nxolib.load_nxo(fileobj)
+    with open(new_path, 'rb') as fileobj:
+        new = nxolib.load_nxo(fileobj)
+    return diff_nxo(old, new)
+
+
+def pair_paths(old, new):
+    # (old path, new path) for two files, or for the modules of two
+    # directories matched by relative path (None for a side without it)
+    if not (os.path.isdir(old) and os.path.isdir(new)):
+        return [(old, new)]
+    old_paths = sorted((os.path.relpath(path, old), path) for path in nxolib.find_nxos([old]))
+    new_paths = sorted((os.path.relpath(path, new), path) for path in nxolib.find_nxos([new]))
+    return [(before, after) for name, before, after in merge(old_paths, new_paths)]
+
+
+def _diff_pair(pair):
+    old_path, new_path = pair
+    if old_path is None or new_path is None:
+        out = {'module': 'added' if old_path is None else 'removed'}
+    else:
+        try:
+            out = diff_files(old_path, new_path)
+        except Exception as e:
+            out = {'error': '%s: %s' % (type(e).__name__, e)}
+    out['old'], out['new'] = old_path, new_path
+    return json.dumps(out, sort_keys=True, encoding='latin-1')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print what changed between two versions of NSO/NRO files')
+    parser.add_argument('old', help='the older file, or a directory of them')
+    parser.add_argument('new', help='the newer file, or a directory of them')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    pool = multiprocessing.Pool(args.jobs, nxolib._quiet_worker)
+    try:
+        for line in pool.imap_unordered(_diff_pair, pair_paths(args.old, args.new)):
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    main()
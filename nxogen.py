@@ -0,0 +1,375 @@
+# nxogen.py: synthetic NSO / NRO generator for benchmarking nxo64.py
+
+import argparse, hashlib, random, struct
+
+from array import array
+
+import lz4.block
+
+(DT_NULL, DT_NEEDED, DT_PLTRELSZ, DT_PLTGOT, DT_HASH, DT_STRTAB, DT_SYMTAB, DT_RELA, DT_RELASZ,
+ DT_RELAENT, DT_STRSZ, DT_SYMENT, DT_INIT, DT_FINI, DT_SONAME) = range(15)
+DT_REL, DT_RELSZ, DT_RELENT, DT_PLTREL, DT_JMPREL = 17, 18, 19, 20, 23
+DT_INIT_ARRAY, DT_FINI_ARRAY, DT_INIT_ARRAYSZ, DT_FINI_ARRAYSZ = 25, 26, 27, 28
+
+R_ARM_GLOB_DAT = 21
+R_ARM_JUMP_SLOT = 22
+R_ARM_RELATIVE = 23
+R_AARCH64_GLOB_DAT = 1025
+R_AARCH64_JUMP_SLOT = 1026
+R_AARCH64_RELATIVE = 1027
+
+DT_GNU_HASH = 0x6ffffef5
+
+PAGE = 0x1000
+
+
+def align(v, a):
+    return (v + a - 1) & ~(a - 1)
+
+
+def gnu_hash(name):
+    h = 5381
+    for c in bytearray(name):
+        h = (h * 33 + c) & 0xFFFFFFFF
+    return h
+
+
+def elf_hash(name):
+    h = 0
+    for c in bytearray(name):
+        h = ((h << 4) + c) & 0xFFFFFFFF
+        g = h & 0xF0000000
+        if g:
+            h ^= g >> 24
+        h &= ~g
+    return h
+
+
+class Blob(object):
+    def __init__(self):
+        self.buf = bytearray()
+
+    def align(self, a):
+        self.buf += '\0' * (align(len(self.buf), a) - len(self.buf))
+
+    def add(self, data):
+        off = len(self.buf)
+        self.buf += data
+        return off
+
+    def reserve(self, size):
+        return self.add('\0' * size)
+
+
+class Module(object):
+    def __init__(self, name='synthetic', exports=1000, imports=100, relocs=10000, text_size=0x100000,
+                 armv7=False, gnu_hash=False, unwind=True, export_name='export', import_name='import', seed=0):
+        self.name = name
+        self.export_name = export_name
+        self.import_name = import_name
+        self.exports = exports
+        self.imports = imports
+        self.relocs = relocs
+        self.text_size = text_size
+        self.armv7 = armv7
+        self.gnu_hash = gnu_hash
+        self.unwind = unwind
+        self.rng = random.Random(seed)
+
+    def build(self):
+        armv7 = self.armv7
+        offsize = 4 if armv7 else 8
+        rng = self.rng
+
+        # .text: branch over the MOD0 pointer, then filler code with BL calls and PLT stubs
+        text = Blob()
+        text.add(struct.pack('<II', 0x14000028 if not armv7 else 0xEA00001E, 0))
+        text.add('\0' * 0x78) # room for an NRO header
+        modoff = text.reserve(0x20)
+        plt_size = 0x10 if not armv7 else 0xC
+        code_start = align(len(text.buf), 0x10)
+        code_size = max(align(self.text_size, 0x10) - code_start - self.imports * plt_size, 0x10)
+        func_count = max(self.exports, 1)
+        func_size = max(align(code_size // func_count, 0x10), 0x10)
+        nop = 0xD503201F if not armv7 else 0xE320F000
+        words = array('I', [nop]) * (code_size // 4)
+        func_starts = [code_start + i * func_size for i in range(func_count) if code_start + i * func_size < code_start + code_size]
+        for i in range(0, len(words), 8):
+            pc = code_start + i * 4
+            target = rng.choice(func_starts)
+            if armv7:
+                words[i] = 0xEB000000 | (((target - (pc + 8)) >> 2) & 0xFFFFFF)
+            else:
+                words[i] = 0x94000000 | (((target - pc) >> 2) & 0x3FFFFFF)
+        text.align(0x10)
+        text.add(words.tostring())
+        plt_start = text.add('\0' * (self.imports * plt_size))
+        text.align(PAGE)
+        text_size = len(text.buf)
+
+        # .rodata: .dynsym, .dynstr, .hash, relocation tables and some strings
+        ro = Blob()
+        names = ['\0']
+        strtab = {'': 0}
+        def add_str(s):
+            if s not in strtab:
+                strtab[s] = sum(len(x) for x in names)
+                names.append(s + '\0')
+            return strtab[s]
+
+        needed = [add_str('libnn_sdk.so'), add_str('libnn_rocrt.so')]
+        soname = add_str(self.name + '.so')
+        syms = [(0, 0, 0, 0, 0, 0)]
+        for i in range(self.imports):
+            syms.append((add_str('_ZN2nn%d%s%dEv' % (len(self.import_name), self.import_name, i)), 0x12, 0, 0, 0, 0))
+        exports = ['_ZN2nn%d%s%dEv' % (len(self.export_name), self.export_name, i) for i in range(self.exports)]
+        nbuckets = max(self.exports // 4, 1)
+        if self.gnu_hash:
+            # GNU hash needs the hashed symbols grouped by bucket
+            exports.sort(key=lambda name: gnu_hash(name) % nbuckets)
+        symoffset = len(syms)
+        for i, name in enumerate(exports):
+            value = func_starts[i % len(func_starts)]
+            syms.append((add_str(name), 0x12, 0, 1, value, func_size))
+        dynstr = ''.join(names)
+        symbols = len(syms)
+
+        ro.align(0x10)
+        symtab_off = ro.reserve(symbols * (0x10 if armv7 else 0x18))
+        strtab_off = ro.add(dynstr)
+        ro.align(4)
+        nbucket = max(symbols // 2, 1)
+        buckets = [0] * nbucket
+        chains = [0] * symbols
+        for i in range(1, symbols):
+            name = dynstr[syms[i][0]:dynstr.index('\0', syms[i][0])]
+            b = elf_hash(name) % nbucket
+            chains[i] = buckets[b]
+            buckets[b] = i
+        hash_off = ro.add(struct.pack('<%dI' % (2 + nbucket + symbols), nbucket, symbols, *(buckets + chains)))
+        ro.align(8)
+        gnu_buckets = [0] * nbuckets
+        gnu_chains = []
+        bloom = [0] * 4
+        bloom_bits = offsize * 8
+        for i, name in enumerate(exports):
+            h = gnu_hash(name)
+            if not gnu_buckets[h % nbuckets]:
+                gnu_buckets[h % nbuckets] = symoffset + i
+            last = i + 1 == len(exports) or gnu_hash(exports[i + 1]) % nbuckets != h % nbuckets
+            gnu_chains.append((h & ~1) | last)
+            bloom[(h // bloom_bits) % 4] |= (1 << (h % bloom_bits)) | (1 << ((h >> 6) % bloom_bits))
+        gnu_hash_off = ro.add(struct.pack('<IIII', nbuckets, symoffset, 4, 6) +
+                              struct.pack('<4' + ('I' if armv7 else 'Q'), *bloom) +
+                              struct.pack('<%dI' % (nbuckets + len(gnu_chains)), *(gnu_buckets + gnu_chains)))
+        ro.align(8)
+        relent = 8 if armv7 else 0x18
+        relative_count = self.relocs
+        got_count = self.imports
+        rela_off = ro.reserve((relative_count + got_count) * relent)
+        jmprel_off = ro.reserve(self.imports * relent)
+        for i in range(200):
+            ro.add('synthetic string %d\0' % i)
+
+        # .eh_frame with one FDE per function, and the .eh_frame_hdr that
+        # MOD0 points at
+        rodata_loc = text_size
+        eh_hdr_off = eh_hdr_end = None
+        if self.unwind:
+            ro.align(8)
+            eh_frame_off = len(ro.buf)
+            # CIE: version 1, "zR" with pcrel|sdata4 pointers, def_cfa sp+0
+            cie = struct.pack('<IB', 0, 1) + 'zR\0' + '\x04\x78\x1e\x01\x1b' + '\x0c\x1f\x00'
+            cie += '\0' * (-len(cie) & 3)
+            ro.add(struct.pack('<I', len(cie)) + cie)
+            code_end = code_start + code_size
+            table = []
+            for start in func_starts:
+                fde_off = len(ro.buf)
+                pc_begin = start - (rodata_loc + fde_off + 8)
+                ro.add(struct.pack('<IiiIB', 0x10, fde_off + 4 - eh_frame_off, pc_begin,
+                                   min(start + func_size, code_end) - start, 0) + '\0' * 3)
+                table.append((start, rodata_loc + fde_off))
+            ro.add(struct.pack('<I', 0))
+            ro.align(4)
+            eh_hdr_off = len(ro.buf)
+            hdr = rodata_loc + eh_hdr_off
+            ro.add(struct.pack('<4BiI', 1, 0x1b, 0x03, 0x3b, rodata_loc + eh_frame_off - (hdr + 4), len(table)))
+            for loc, fde in table:
+                ro.add(struct.pack('<ii', loc - hdr, fde - hdr))
+            eh_hdr_end = len(ro.buf)
+
+        ro.align(PAGE)
+        rodata_size = len(ro.buf)
+
+        # .data: .dynamic, .got.plt, .got, .init_array and pointer tables
+        data = Blob()
+        dynamic_off = data.reserve(0x10 * 32)
+        data.align(0x10)
+        # without imports there is no PLT, so no .got.plt either
+        gotplt_off = data.reserve((3 + self.imports) * offsize if self.imports else 0)
+        got_off = data.reserve(got_count * offsize)
+        # the first relative relocations fill .init_array (up to 4 entries)
+        init_count = min(relative_count, 4)
+        init_off = data.reserve(init_count * offsize)
+        table_off = data.reserve((relative_count - init_count) * offsize)
+        data.align(0x10)
+        data_size = len(data.buf)
+        bss_size = 0x1000
+
+        data_loc = rodata_loc + rodata_size
+        bss_loc = data_loc + data_size
+
+        # fill in .dynsym
+        for i, (st_name, st_info, st_other, st_shndx, st_value, st_size) in enumerate(syms):
+            if armv7:
+                struct.pack_into('<IIIBBH', ro.buf, symtab_off + i * 0x10, st_name, st_value, st_size, st_info, st_other, st_shndx)
+            else:
+                struct.pack_into('<IBBHQQ', ro.buf, symtab_off + i * 0x18, st_name, st_info, st_other, st_shndx, st_value, st_size)
+
+        # relocations
+        def put_reloc(off, offset, r_type, r_sym, addend):
+            if armv7:
+                struct.pack_into('<II', ro.buf, off, offset, (r_sym << 8) | r_type)
+            else:
+                struct.pack_into('<QQq', ro.buf, off, offset, (r_sym << 32) | r_type, addend)
+
+        pos = rela_off
+        slots = [data_loc + init_off + i * offsize for i in range(init_count)] + \
+                [data_loc + table_off + i * offsize for i in range(relative_count - init_count)]
+        for slot in slots:
+            target = rng.choice(func_starts)
+            if armv7:
+                struct.pack_into('<I', data.buf, slot - data_loc, target)
+            put_reloc(pos, slot, R_ARM_RELATIVE if armv7 else R_AARCH64_RELATIVE, 0, target)
+            pos += relent
+        for i in range(got_count):
+            put_reloc(pos, data_loc + got_off + i * offsize, R_ARM_GLOB_DAT if armv7 else R_AARCH64_GLOB_DAT, 1 + i, 0)
+            pos += relent
+        for i in range(self.imports):
+            put_reloc(jmprel_off + i * relent, data_loc + gotplt_off + (3 + i) * offsize,
+                      R_ARM_JUMP_SLOT if armv7 else R_AARCH64_JUMP_SLOT, 1 + i, 0)
+
+        # PLT stubs
+        for i in range(self.imports):
+            pc = plt_start + i * plt_size
+            slot = data_loc + gotplt_off + (3 + i) * offsize
+            if armv7:
+                delta = slot - (pc + 8)
+                insns = (0xE28FC600 | ((delta >> 20) & 0xFF),
+                         0xE28CCA00 | ((delta >> 12) & 0xFF),
+                         0xE5BCF000 | (delta & 0xFFF))
+                struct.pack_into('<III', text.buf, pc, *insns)
+            else:
+                page = ((slot & ~0xFFF) - (pc & ~0xFFF)) >> 12
+                lo = slot & 0xFFF
+                insns = (0x90000010 | ((page & 3) << 29) | (((page >> 2) & 0x7FFFF) << 5),
+                         0xF9400211 | ((lo >> 3) << 10),
+                         0x91000210 | (lo << 10),
+                         0xD61F0220)
+                struct.pack_into('<IIII', text.buf, pc, *insns)
+
+        # .dynamic
+        entries = [(DT_NEEDED, n) for n in needed] + [
+            (DT_SONAME, soname),
+            (DT_GNU_HASH, rodata_loc + gnu_hash_off) if self.gnu_hash else (DT_HASH, rodata_loc + hash_off),
+            (DT_STRTAB, rodata_loc + strtab_off),
+            (DT_SYMTAB, rodata_loc + symtab_off),
+            (DT_STRSZ, len(dynstr)),
+            (DT_SYMENT, 0x10 if armv7 else 0x18),
+        ]
+        if relative_count + got_count:
+            entries += [
+                (DT_REL if armv7 else DT_RELA, rodata_loc + rela_off),
+                (DT_RELSZ if armv7 else DT_RELASZ, (relative_count + got_count) * relent),
+                (DT_RELENT if armv7 else DT_RELAENT, relent),
+            ]
+        if self.imports:
+            entries += [
+                (DT_JMPREL, rodata_loc + jmprel_off),
+                (DT_PLTRELSZ, self.imports * relent),
+                (DT_PLTREL, DT_REL if armv7 else DT_RELA),
+                (DT_PLTGOT, data_loc + gotplt_off),
+            ]
+        if init_count:
+            entries += [
+                (DT_INIT_ARRAY, data_loc + init_off),
+                (DT_INIT_ARRAYSZ, init_count * offsize),
+            ]
+        entries.append((DT_NULL, 0))
+        for i, (tag, val) in enumerate(entries):
+            if armv7:
+                struct.pack_into('<II', data.buf, dynamic_off + i * 8, tag, val)
+            else:
+                struct.pack_into('<QQ', data.buf, dynamic_off + i * 0x10, tag, val)
+
+        # MOD0
+        if eh_hdr_off is None:
+            unwind = (0, 0)
+        else:
+            unwind = (rodata_loc + eh_hdr_off - modoff, rodata_loc + eh_hdr_end - modoff)
+        struct.pack_into('<I', text.buf, 4, modoff)
+        struct.pack_into('<4siiiiii', text.buf, modoff, 'MOD0',
+                         data_loc + dynamic_off - modoff, bss_loc - modoff, bss_loc + bss_size - modoff,
+                         unwind[0], unwind[1], bss_loc - modoff)
+        return str(text.buf), str(ro.buf), str(data.buf), bss_size
+
+
+def write_nso(f, module):
+    text, ro, data, bss_size = module.build()
+    segments = [text, ro, data]
+    compressed = [lz4.block.compress(s, store_size=False) for s in segments]
+    header = bytearray(0x100)
+    # compressed, with hashes to check
+    struct.pack_into('<4sIII', header, 0, 'NSO0', 0, 0, 0x3F)
+    fileoff = 0x100
+    memoff = 0
+    for i, (seg, comp) in enumerate(zip(segments, compressed)):
+        struct.pack_into('<III', header, 0x10 + i * 0x10, fileoff, memoff, len(seg))
+        struct.pack_into('<I', header, 0x60 + i * 4, len(comp))
+        header[0xA0 + i * 0x20:0xC0 + i * 0x20] = hashlib.sha256(seg).digest()
+        fileoff += len(comp)
+        memoff += len(seg)
+    struct.pack_into('<I', header, 0x3C, bss_size)
+    f.write(header)
+    for comp in compressed:
+        f.write(comp)
+
+
+def write_nro(f, module):
+    text, ro, data, bss_size = module.build()
+    image = bytearray(text + ro + data)
+    struct.pack_into('<4sII', image, 0x10, 'NRO0', 0, len(image))
+    struct.pack_into('<IIIIII', image, 0x20, 0, len(text), len(text), len(ro), len(text) + len(ro), len(data))
+    struct.pack_into('<I', image, 0x38, bss_size)
+    f.write(image)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic NSO or NRO file')
+    parser.add_argument('path', help='output file; a .nro extension writes an NRO, anything else an NSO')
+    parser.add_argument('--exports', type=int, default=1000, help='exported functions (default: %(default)s)')
+    parser.add_argument('--imports', type=int, default=100, help='imported functions, each with a PLT stub (default: %(default)s)')
+    parser.add_argument('--relocs', type=int, default=10000, help='relative relocations (default: %(default)s)')
+    parser.add_argument('--text-size', type=lambda s: int(s, 0), default=0x100000, help='size of .text (default: 0x100000)')
+    parser.add_argument('--armv7', action='store_true', help='32-bit module')
+    parser.add_argument('--gnu-hash', action='store_true', help='use DT_GNU_HASH instead of DT_HASH')
+    parser.add_argument('--export-name', default='export', help='exports are called _ZN2nn<len><name><i>Ev')
+    parser.add_argument('--import-name', default='import', help='imports are called _ZN2nn<len><name><i>Ev, so a set of '
+                        'modules can import from each other')
+    parser.add_argument('--no-unwind', dest='unwind', action='store_false', help='leave out .eh_frame / .eh_frame_hdr')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    module = Module(exports=args.exports, imports=args.imports, relocs=args.relocs, text_size=args.text_size,
+                    armv7=args.armv7, gnu_hash=args.gnu_hash, unwind=args.unwind, export_name=args.export_name,
+                    import_name=args.import_name, seed=args.seed)
+    with open(args.path, 'wb') as f:
+        if args.path.lower().endswith('.nro'):
+            write_nro(f, module)
+        else:
+            write_nso(f, module)
+
+
+if __name__ == '__main__':
+    main()
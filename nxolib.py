@@ -0,0 +1,2140 @@
+# Copyright 2017 Reswitched Team
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose with or
+# without fee is hereby granted, provided that the above copyright notice and this permission
+# notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS
+# SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL
+# THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY
+# DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE
+# OR PERFORMANCE OF THIS SOFTWARE.
+
+# nxolib.py: library for reading nso/nro files, used by the nxo64.py loader
+
+# only cheap modules are imported here; lz4, collections, the thread pools and
+# so on are imported where they're used
+import bisect, contextlib, marshal, os, struct, sys, time
+
+from array import array
+
+
+def uncompress(data, uncompressed_size):
+    import lz4.block
+    return lz4.block.decompress(data, uncompressed_size=uncompressed_size)
+
+
+def nxo_kind(header):
+    # 'NSO', 'NRO' or None from the first 0x14 bytes of a file
+    if header[:4] == 'NSO0':
+        return 'NSO'
+    if header[0x10:0x14] == 'NRO0':
+        return 'NRO'
+    return None
+
+
+# reads this close to the start of a segment are served by decoding just the
+# front of its LZ4 block (e.g. the MOD0 pointer at the start of .text)
+LAZY_PREFIX_SIZE = 0x1000
+
+
+def uncompress_prefix(src, size):
+    # decodes LZ4 block sequences until at least `size` bytes are out; may
+    # return less if `src` runs out first
+    src = bytearray(src)
+    out = bytearray()
+    pos = 0
+    try:
+        while len(out) < size and pos < len(src):
+            token = src[pos]
+            pos += 1
+            n = token >> 4
+            if n == 15:
+                while True:
+                    n += src[pos]
+                    pos += 1
+                    if src[pos-1] != 255: break
+            out += src[pos:pos+n]
+            pos += n
+            if pos >= len(src):
+                break
+            offset = src[pos] | (src[pos+1] << 8)
+            pos += 2
+            n = (token & 15) + 4
+            if n == 19:
+                while True:
+                    n += src[pos]
+                    pos += 1
+                    if src[pos-1] != 255: break
+            if not 0 < offset <= len(out):
+                break
+            # overlapping copy, doubling the repeated span each time round
+            n = min(n, size - len(out))
+            start = len(out) - offset
+            while n > 0:
+                chunk = out[start:start+min(n, len(out)-start)]
+                out += chunk
+                n -= len(chunk)
+    except IndexError:
+        pass
+    return out
+
+_structs = {}
+
+
+def get_struct(fmt):
+    # little-endian struct.Struct objects, compiled once per format
+    try:
+        return _structs[fmt]
+    except KeyError:
+        s = _structs[fmt] = struct.Struct('<' + fmt)
+        return s
+
+
+class BinFile(object):
+    def __init__(self, li):
+        self._f = li
+
+    def read(self, arg):
+        if isinstance(arg, str):
+            s = get_struct(arg)
+            out = s.unpack(self._f.read(s.size))
+            if len(out) == 1:
+                return out[0]
+            return out
+        elif arg is None:
+            return self._f.read()
+        else:
+            out = self._f.read(arg)
+            return out
+
+    def read_from(self, arg, offset):
+        old = self.tell()
+        try:
+            self.seek(offset)
+            out = self.read(arg)
+        finally:
+            self.seek(old)
+        return out
+
+    def read_array(self, fmt, offset, count):
+        # count consecutive fmt records as one flat tuple
+        fmt = '<%d%s' % (count, fmt)
+        return struct.unpack(fmt, self.read_from(struct.calcsize(fmt), offset))
+
+    def seek(self, off):
+        self._f.seek(off)
+
+    def close(self):
+        self._f.close()
+
+    def tell(self):
+        return self._f.tell()
+
+
+class BufferBinFile(BinFile):
+    # reads straight out of an in-memory (or mapped) image at explicit
+    # offsets; raw reads return memoryview slices so the image is never copied
+    def __init__(self, buf):
+        mmap = sys.modules.get('mmap')
+        if mmap is not None and isinstance(buf, mmap.mmap):
+            buf = buffer(buf)
+        self._buf = memoryview(buf)
+        self._pos = 0
+
+    def read(self, arg):
+        out = self.read_from(arg, self._pos)
+        self._pos += get_struct(arg).size if isinstance(arg, str) else len(out)
+        return out
+
+    def read_from(self, arg, offset):
+        if isinstance(arg, str):
+            out = get_struct(arg).unpack_from(self._buf, offset)
+            if len(out) == 1:
+                return out[0]
+            return out
+        elif arg is None:
+            return self._buf[offset:]
+        else:
+            return self._buf[offset:offset+arg]
+
+    def read_array(self, fmt, offset, count):
+        return struct.unpack_from('<%d%s' % (count, fmt), self._buf, offset)
+
+    def seek(self, off):
+        self._pos = off
+
+    def close(self):
+        self._buf = None
+
+    def tell(self):
+        return self._pos
+
+
+class LazyBinFile(BufferBinFile):
+    # an NSO image whose segments are decompressed the first time something
+    # reads from them
+    def __init__(self, image, f, segments):
+        super(LazyBinFile, self).__init__(image)
+        self._image = image
+        self._file = f
+        # [fileoff, filesize, loc, size, end, bytes already in the image]
+        self._segments = [list(i) + [0] for i in segments]
+        self._pending = True
+        self._window = (0, 0)
+
+    def read_from(self, arg, offset):
+        if self._pending:
+            if isinstance(arg, str):
+                size = get_struct(arg).size
+            elif arg is None:
+                size = len(self._buf) - offset
+            else:
+                size = arg
+            self.require(offset, offset + size)
+        return super(LazyBinFile, self).read_from(arg, offset)
+
+    def read_array(self, fmt, offset, count):
+        if self._pending:
+            self.require(offset, offset + struct.calcsize('<%d%s' % (count, fmt)))
+        return super(LazyBinFile, self).read_array(fmt, offset, count)
+
+    def require(self, start, end):
+        lo, hi = self._window
+        if start < lo or end > hi:
+            self.load(start, end)
+
+    def load(self, start=0, end=None):
+        if end is None:
+            end = len(self._image)
+        self._pending = False
+        self._window = (0, 0)
+        for segment in self._segments:
+            fileoff, filesize, loc, size, segend, ready = segment
+            top = min(loc + size, segend)
+            if start < top and end > loc + ready:
+                if end - loc <= LAZY_PREFIX_SIZE:
+                    data = uncompress_prefix(self._file.read_from(min(filesize, 2 * LAZY_PREFIX_SIZE), fileoff), LAZY_PREFIX_SIZE)
+                    data = data[:top - loc]
+                    if loc + len(data) >= end:
+                        self._image[loc:loc+len(data)] = data
+                        ready = segment[5] = len(data)
+                if end > loc + ready:
+                    decompress_segment(self._image, self._file.read_from(filesize, fileoff), loc, size, segend)
+                    ready = segment[5] = top - loc
+            if ready < top - loc:
+                self._pending = True
+            if loc <= start < top:
+                # nearby reads can skip straight to the buffer
+                self._window = (loc, loc + ready)
+
+
+(DT_NULL, DT_NEEDED, DT_PLTRELSZ, DT_PLTGOT, DT_HASH, DT_STRTAB, DT_SYMTAB, DT_RELA, DT_RELASZ,
+ DT_RELAENT, DT_STRSZ, DT_SYMENT, DT_INIT, DT_FINI, DT_SONAME, DT_RPATH, DT_SYMBOLIC, DT_REL,
+ DT_RELSZ, DT_RELENT, DT_PLTREL, DT_DEBUG, DT_TEXTREL, DT_JMPREL, DT_BIND_NOW, DT_INIT_ARRAY,
+ DT_FINI_ARRAY, DT_INIT_ARRAYSZ, DT_FINI_ARRAYSZ, DT_RUNPATH, DT_FLAGS) = xrange(31)
+DT_GNU_HASH = 0x6ffffef5
+DT_VERSYM = 0x6ffffff0
+DT_RELACOUNT = 0x6ffffff9
+DT_RELCOUNT = 0x6ffffffa
+DT_FLAGS_1 = 0x6ffffffb
+DT_VERDEF = 0x6ffffffc
+DT_VERDEFNUM = 0x6ffffffd
+
+STT_NOTYPE = 0
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_SECTION = 3
+
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+
+(SHT_NULL, SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB, SHT_RELA, SHT_HASH, SHT_DYNAMIC, SHT_NOTE,
+ SHT_NOBITS, SHT_REL, SHT_SHLIB, SHT_DYNSYM) = xrange(12)
+SHT_INIT_ARRAY = 14
+SHT_FINI_ARRAY = 15
+SHT_GNU_HASH = 0x6ffffff6
+
+SHF_WRITE = 1
+SHF_ALLOC = 2
+SHF_EXECINSTR = 4
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_GNU_EH_FRAME = 0x6474e550
+
+PF_X = 1
+PF_W = 2
+PF_R = 4
+
+EM_ARM = 40
+EM_AARCH64 = 183
+
+R_ARM_ABS32 = 2
+R_ARM_TLS_DESC = 13
+R_ARM_GLOB_DAT = 21
+R_ARM_JUMP_SLOT = 22
+R_ARM_RELATIVE = 23
+
+R_AARCH64_ABS64 = 257
+R_AARCH64_GLOB_DAT = 1025
+R_AARCH64_JUMP_SLOT = 1026
+R_AARCH64_RELATIVE = 1027
+R_AARCH64_TLSDESC = 1031
+
+MULTIPLE_DTS = set([DT_NEEDED])
+
+DW_EH_PE_absptr = 0x00
+DW_EH_PE_uleb128 = 0x01
+DW_EH_PE_sleb128 = 0x09
+DW_EH_PE_pcrel = 0x10
+DW_EH_PE_datarel = 0x30
+DW_EH_PE_omit = 0xff
+EH_PE_FORMATS = {0x02: 'H', 0x03: 'I', 0x04: 'Q', 0x0a: 'h', 0x0b: 'i', 0x0c: 'q'}
+
+# Python 2 has no 'q' arrays, and 'l' is only 64-bit outside Windows
+try:
+    INT64_TYPECODE = array('q').typecode
+except ValueError:
+    INT64_TYPECODE = 'l' if array('l').itemsize == 8 else None
+
+
+def int64_array(values=()):
+    if INT64_TYPECODE is None:
+        return list(values)
+    return array(INT64_TYPECODE, values)
+
+
+class Range(object):
+    def __init__(self, start, size):
+        self.start = start
+        self.size = size
+        self.end = start+size
+        self._inclend = start+size-1
+
+    def overlaps(self, other):
+        return self.start <= other._inclend and other.start <= self._inclend
+
+    def includes(self, other):
+        return other.start >= self.start and other._inclend <= self._inclend
+
+    def __repr__(self):
+        return 'Range(0x%X -> 0x%X)' % (self.start, self.end)
+
+
+class IntervalList(object):
+    # non-overlapping things with a .range, kept sorted by start so overlap,
+    # containment and address queries are a bisect away. Empty ranges never
+    # overlap or contain anything.
+    def __init__(self):
+        self.items = []
+        self._starts = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def _before(self, i):
+        # the last non-empty item before index i
+        while i > 0:
+            i -= 1
+            if self.items[i].range.size:
+                return self.items[i]
+        return None
+
+    def overlapping(self, r):
+        item = self._before(bisect.bisect_left(self._starts, r.end))
+        if item is not None and item.range.overlaps(r):
+            return item
+        return None
+
+    def containing(self, r):
+        item = self._before(bisect.bisect_right(self._starts, r.start))
+        if item is not None and item.range.includes(r):
+            return item
+        return None
+
+    def at(self, addr):
+        item = self._before(bisect.bisect_right(self._starts, addr))
+        if item is not None and addr < item.range.end:
+            return item
+        return None
+
+    def add(self, item):
+        i = bisect.bisect_right(self._starts, item.range.start)
+        self._starts.insert(i, item.range.start)
+        self.items.insert(i, item)
+
+
+class Segment(object):
+    def __init__(self, r, name, kind):
+        self.range = r
+        self.name = name
+        self.kind = kind
+        self.sections = IntervalList()
+
+    def add_section(self, s):
+        i = self.sections.overlapping(s.range)
+        assert i is None, '%r overlaps %r' % (s, i)
+        self.sections.add(s)
+
+
+class Section(object):
+    def __init__(self, r, name):
+        self.range = r
+        self.name = name
+
+    def __repr__(self):
+        return 'Section(%r, %r)' % (self.range, self.name)
+
+
+def suffixed_name(name, suffix):
+    if suffix == 0:
+        return name
+    return '%s.%d' % (name, suffix)
+
+
+class SegmentBuilder(object):
+    def __init__(self):
+        self.segments = IntervalList()
+
+    def add_segment(self, start, size, name, kind):
+        r = Range(start, size)
+        assert self.segments.overlapping(r) is None
+        self.segments.add(Segment(r, name, kind))
+
+    def add_section(self, name, start, end=None, size=None):
+        assert end is None or size is None
+        if size is None:
+            size = end-start
+        assert size > 0
+        r = Range(start, size)
+        segment = self.segments.containing(r)
+        assert segment is not None, "no containing segment for %r" % (name,)
+        segment.add_section(Section(r, name))
+
+    def segment_at(self, addr):
+        return self.segments.at(addr)
+
+    def section_at(self, addr):
+        segment = self.segments.at(addr)
+        if segment is None:
+            return None
+        return segment.sections.at(addr)
+
+    def flatten(self):
+        parts = []
+        for segment in self.segments:
+            suffix = 0
+            pos = segment.range.start
+            for section in segment.sections:
+                if pos < section.range.start:
+                    parts.append((pos, section.range.start, suffixed_name(segment.name, suffix), segment.kind))
+                    suffix += 1
+                    pos = section.range.start
+                parts.append((section.range.start, section.range.end, section.name, segment.kind))
+                pos = section.range.end
+            if pos < segment.range.end:
+                parts.append((pos, segment.range.end, suffixed_name(segment.name, suffix), segment.kind))
+                suffix += 1
+                pos = segment.range.end
+        return parts
+
+
+class ElfSym(object):
+    __slots__ = ('name', 'shndx', 'value', 'size', 'vis', 'type', 'bind', 'index')
+
+    def __init__(self, name, info, other, shndx, value, size, index=None):
+        self.index = index
+        self.name = name
+        self.shndx = shndx
+        self.value = value
+        self.size = size
+
+        self.vis = other & 3
+        self.type = info & 0xF
+        self.bind = info >> 4
+
+    def __repr__(self):
+        return 'Sym(name=%r, shndx=0x%X, value=0x%X, size=0x%X, vis=%r, type=%r, bind=%r)' % (
+            self.name, self.shndx, self.value, self.size, self.vis, self.type, self.bind)
+
+
+class SymbolTable(object):
+    # .dynsym decoded in one pass into parallel columns; ElfSym objects are
+    # only built (and names only looked up in .dynstr) when asked for
+    def __init__(self, raw, armv7, dynstr):
+        if armv7:
+            count = len(raw) // 0x10
+            words = struct.unpack_from('<%dI' % (4 * count), raw)
+            names, values, sizes = words[0::4], words[1::4], words[2::4]
+            info_off, shndx_half, entsize = 12, 7, 0x10
+        else:
+            count = len(raw) // 0x18
+            words = struct.unpack_from('<%dI' % (6 * count), raw)
+            fields = struct.unpack_from('<%dq' % (3 * count), raw)
+            names, values, sizes = words[0::6], fields[1::3], fields[2::3]
+            info_off, shndx_half, entsize = 4, 3, 0x18
+        halves = struct.unpack_from('<%dH' % (entsize // 2 * count), raw)
+
+        # the table ends at the first entry whose name is out of range
+        limit = len(dynstr)
+        self.consumed = count
+        for i, name in enumerate(names):
+            if name > limit:
+                count = i
+                self.consumed = i + 1
+                break
+
+        raw = raw[:count * entsize].tobytes() if isinstance(raw, memoryview) else raw[:count * entsize]
+        self.dynstr = dynstr
+        self.names = array('I', names[:count])
+        self.infos = array('B', raw[info_off::entsize])
+        self.others = array('B', raw[info_off+1::entsize])
+        self.shndxs = array('H', halves[shndx_half::entsize // 2][:count])
+        self.values = int64_array(values[:count])
+        self.sizes = int64_array(sizes[:count])
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.names)
+        return ElfSym(self.name(i), self.infos[i], self.others[i], self.shndxs[i], self.values[i], self.sizes[i], i)
+
+    def __iter__(self):
+        for i in xrange(len(self.names)):
+            yield self[i]
+
+    def name(self, i):
+        o = self.names[i]
+        return self.dynstr[o:self.dynstr.index('\0', o)]
+
+
+def elf_hash(name):
+    h = 0
+    for c in bytearray(name):
+        h = ((h << 4) + c) & 0xFFFFFFFF
+        h ^= (h >> 24) & 0xF0
+    return h & 0x0FFFFFFF
+
+
+def gnu_hash(name):
+    h = 5381
+    for c in bytearray(name):
+        h = (h * 33 + c) & 0xFFFFFFFF
+    return h
+
+
+class SysvHashTable(object):
+    name = '.hash'
+
+    def __init__(self, f, offset):
+        nbucket, nchain = f.read_from('II', offset)
+        self.buckets = array('I', f.read_array('I', offset + 8, nbucket))
+        self.chains = array('I', f.read_array('I', offset + 8 + nbucket * 4, nchain))
+        self.count = nchain
+        self.size = 8 + (nbucket + nchain) * 4
+
+    def lookup(self, symbols, name):
+        if not self.buckets:
+            return None
+        i = self.buckets[elf_hash(name) % len(self.buckets)]
+        while i:
+            if symbols.shndxs[i] and symbols.name(i) == name:
+                return i
+            i = self.chains[i] if i < len(self.chains) else 0
+        return None
+
+
+class GnuHashTable(object):
+    name = '.gnu.hash'
+
+    def __init__(self, f, offset, offsize):
+        nbuckets, self.symoffset, bloom_size, self.bloom_shift = f.read_from('IIII', offset)
+        self.bloom_bits = offsize * 8
+        bloomoff = offset + 16
+        self.bloom = f.read_array('I' if offsize == 4 else 'Q', bloomoff, bloom_size)
+        bucketoff = bloomoff + bloom_size * offsize
+        self.buckets = array('I', f.read_array('I', bucketoff, nbuckets))
+        chainoff = bucketoff + nbuckets * 4
+
+        # the symbol count is one past the end of the chain that starts at the
+        # highest bucket
+        count = max(self.buckets) if self.buckets else 0
+        if count < self.symoffset:
+            count = self.symoffset
+        else:
+            while not f.read_from('I', chainoff + (count - self.symoffset) * 4) & 1:
+                count += 1
+            count += 1
+        self.count = count
+        nchain = count - self.symoffset
+        self.chains = array('I', f.read_array('I', chainoff, nchain))
+        self.size = chainoff + nchain * 4 - offset
+
+    def lookup(self, symbols, name):
+        if not self.buckets:
+            return None
+        h = gnu_hash(name)
+        word = self.bloom[(h // self.bloom_bits) % len(self.bloom)]
+        mask = (1 << (h % self.bloom_bits)) | (1 << ((h >> self.bloom_shift) % self.bloom_bits))
+        if word & mask != mask:
+            return None
+        i = self.buckets[h % len(self.buckets)]
+        if i < self.symoffset:
+            return None
+        while i - self.symoffset < len(self.chains):
+            h2 = self.chains[i - self.symoffset]
+            if (h | 1) == (h2 | 1) and symbols.shndxs[i] and symbols.name(i) == name:
+                return i
+            if h2 & 1:
+                break
+            i += 1
+        return None
+
+
+class RelocationTable(object):
+    # one DT_REL / DT_RELA / DT_JMPREL table, decoded in bulk into columns
+    def __init__(self, tag, raw, armv7):
+        self.tag = tag
+        # NOTE: currently assumes all armv7 relocs have no addends,
+        # and all 64-bit ones do.
+        if armv7:
+            count = len(raw) // 8
+            words = struct.unpack_from('<%dI' % (2 * count), raw)
+            self.offsets = array('I', words[0::2])
+            self.types = array('I', [i & 0xff for i in words[1::2]])
+            self.syms = array('I', [i >> 8 for i in words[1::2]])
+            self.addends = None
+        else:
+            count = len(raw) // 0x18
+            fields = struct.unpack_from('<%dq' % (3 * count), raw)
+            words = struct.unpack_from('<%dI' % (6 * count), raw)
+            self.offsets = int64_array(fields[0::3])
+            self.types = array('I', words[2::6])
+            self.syms = array('I', words[3::6])
+            self.addends = int64_array(fields[2::3])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        if self.addends is None:
+            return ((offset, r_type, r_sym, None) for offset, r_type, r_sym in zip(self.offsets, self.types, self.syms))
+        return iter(zip(self.offsets, self.types, self.syms, self.addends))
+
+    def locations(self):
+        if R_AARCH64_TLSDESC not in self.types and R_ARM_TLS_DESC not in self.types:
+            return set(self.offsets)
+        return set(offset for offset, r_type in zip(self.offsets, self.types)
+                   if r_type != R_AARCH64_TLSDESC and r_type != R_ARM_TLS_DESC)
+
+
+class Relocations(object):
+    # (offset, r_type, sym, addend) tuples over all of a module's tables
+    def __init__(self, tables, symbols):
+        self.tables = tables
+        self.symbols = symbols
+
+    def __len__(self):
+        return sum(len(table) for table in self.tables)
+
+    def __iter__(self):
+        symbols = self.symbols
+        for table in self.tables:
+            for offset, r_type, r_sym, addend in table:
+                yield offset, r_type, (symbols[r_sym] if r_sym != 0 else None), addend
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        for table in self.tables:
+            if i < len(table):
+                r_sym = table.syms[i]
+                return (table.offsets[i], table.types[i], (self.symbols[r_sym] if r_sym != 0 else None),
+                        table.addends[i] if table.addends is not None else None)
+            i -= len(table)
+        raise IndexError('relocation index out of range')
+
+
+def find_words(data, needle, skew=0):
+    # indices of the 4-byte aligned words in `data` that have `needle` at
+    # byte `skew`
+    out = []
+    pos = data.find(needle, skew)
+    while pos != -1:
+        if (pos - skew) % 4 == 0:
+            out.append((pos - skew) // 4)
+        pos = data.find(needle, pos + 1)
+    return out
+
+
+def arm_expand_imm(insn):
+    # an ARM data-processing immediate: imm8 rotated right by twice rot
+    imm = insn & 0xff
+    rot = ((insn >> 8) & 0xf) * 2
+    return ((imm >> rot) | (imm << (32 - rot))) & 0xffffffff
+
+
+def read_uleb128(f, pos):
+    value = shift = 0
+    while True:
+        b = f.read_from('B', pos)
+        pos += 1
+        value |= (b & 0x7f) << shift
+        shift += 7
+        if not b & 0x80:
+            return value, pos
+
+
+def read_sleb128(f, pos):
+    value, end = read_uleb128(f, pos)
+    bits = 7 * (end - pos)
+    if value >> (bits - 1):
+        value -= 1 << bits
+    return value, end
+
+
+def read_encoded(f, pos, enc, offsize, datarel=0):
+    # a DW_EH_PE_* encoded pointer at pos, as (value, position after it)
+    fmt = enc & 0x0f
+    if fmt == DW_EH_PE_absptr:
+        value, end = f.read_from('I' if offsize == 4 else 'Q', pos), pos + offsize
+    elif fmt == DW_EH_PE_uleb128:
+        value, end = read_uleb128(f, pos)
+    elif fmt == DW_EH_PE_sleb128:
+        value, end = read_sleb128(f, pos)
+    elif fmt in EH_PE_FORMATS:
+        value, end = f.read_from(EH_PE_FORMATS[fmt], pos), pos + get_struct(EH_PE_FORMATS[fmt]).size
+    else:
+        raise NxoException('unsupported pointer encoding 0x%X' % enc)
+    if enc & 0x70 == DW_EH_PE_pcrel:
+        value += pos
+    elif enc & 0x70 == DW_EH_PE_datarel:
+        value += datarel
+    elif enc & 0x70:
+        raise NxoException('unsupported pointer encoding 0x%X' % enc)
+    return value, end
+
+
+class UnwindTable(object):
+    # .eh_frame_hdr (which MOD0 points at) and the .eh_frame FDEs that its
+    # binary search table indexes
+    def __init__(self, f, offset, end, offsize):
+        self.binfile = f
+        self.offset = offset
+        self.end = end
+        self.offsize = offsize
+        version, ptr_enc, count_enc, self.table_enc = f.read_from('4B', offset)
+        if version != 1:
+            raise NxoException('unknown .eh_frame_hdr version %d' % version)
+        self.eh_frame, pos = read_encoded(f, offset + 4, ptr_enc, offsize, offset)
+        self.count = 0
+        if count_enc != DW_EH_PE_omit and self.table_enc != DW_EH_PE_omit:
+            self.count, pos = read_encoded(f, pos, count_enc, offsize, offset)
+        self.table_offset = pos
+        # known once functions() has walked the FDEs
+        self.eh_frame_end = None
+
+    def entries(self):
+        # (initial location, FDE offset) pairs, sorted by location
+        f = self.binfile
+        if self.table_enc == DW_EH_PE_datarel | 0x0b:
+            # datarel sdata4, which is what toolchains emit
+            fields = f.read_array('i', self.table_offset, 2 * self.count)
+            return zip([self.offset + i for i in fields[0::2]], [self.offset + i for i in fields[1::2]])
+        out = []
+        pos = self.table_offset
+        for i in xrange(self.count):
+            loc, pos = read_encoded(f, pos, self.table_enc, self.offsize, self.offset)
+            fde, pos = read_encoded(f, pos, self.table_enc, self.offsize, self.offset)
+            out.append((loc, fde))
+        return out
+
+    def cie_encoding(self, cie):
+        # the FDE pointer encoding from a CIE's "zR" augmentation
+        f = self.binfile
+        pos = cie + 8
+        if f.read_from('I', cie) == 0xffffffff:
+            pos = cie + 20
+        version = f.read_from('B', pos)
+        pos += 1
+        aug = ''
+        while True:
+            c = f.read_from('c', pos)
+            pos += 1
+            if c == '\0':
+                break
+            aug += c
+        if 'eh' in aug:
+            pos += self.offsize
+        pos = read_uleb128(f, pos)[1]
+        pos = read_sleb128(f, pos)[1]
+        pos = pos + 1 if version == 1 else read_uleb128(f, pos)[1]
+        enc = DW_EH_PE_absptr
+        if aug.startswith('z'):
+            pos = read_uleb128(f, pos)[1]
+            for c in aug[1:]:
+                if c == 'R':
+                    enc = f.read_from('B', pos)
+                    pos += 1
+                elif c == 'P':
+                    # personality routine; DW_EH_PE_indirect doesn't change the size
+                    pos = read_encoded(f, pos + 1, f.read_from('B', pos) & 0x7f, self.offsize)[1]
+                elif c == 'L':
+                    pos += 1
+                elif c not in 'SB':
+                    break
+        return enc
+
+    def functions(self):
+        # sorted arrays of function starts and ends, from the FDE of every
+        # entry in the table
+        f = self.binfile
+        encodings = {}
+        ranges = []
+        self.eh_frame_end = self.eh_frame
+        for loc, fde in self.entries():
+            length, cie_ptr = f.read_from('II', fde)
+            if length == 0xffffffff:
+                length, cie_ptr = f.read_from('QQ', fde + 4)
+                cie, pos, fde_end = fde + 12 - cie_ptr, fde + 20, fde + 12 + length
+            else:
+                cie, pos, fde_end = fde + 4 - cie_ptr, fde + 8, fde + 4 + length
+            enc = encodings.get(cie)
+            if enc is None:
+                enc = encodings[cie] = self.cie_encoding(cie)
+            start, pos = read_encoded(f, pos, enc, self.offsize)
+            size = read_encoded(f, pos, enc & 0x0f, self.offsize)[0]
+            ranges.append((start, start + size))
+            self.eh_frame_end = max(self.eh_frame_end, fde_end)
+        # a zero length ends .eh_frame
+        if f.read_from('I', self.eh_frame_end) == 0:
+            self.eh_frame_end += 4
+        ranges.sort()
+        return array('I', [start for start, end in ranges]), array('I', [end for start, end in ranges])
+
+
+class StringIndex(object):
+    # the NUL-terminated printable ASCII strings of at least min_length
+    # characters in some chunks of an image, given as (module offset, bytes)
+    # in address order: sorted arrays of start and end (the offset of the NUL)
+    # module offsets, and of the strings' hashes for find
+    def __init__(self, chunks, min_length=4):
+        import re
+        pattern = re.compile('[\t\n\r\x20-\x7e]{%d,}\0' % (min_length,))
+        self.chunk_starts = array('I')
+        self.chunks = []
+        self.starts = array('I')
+        self.ends = array('I')
+        hashes = []
+        for base, data in chunks:
+            self.chunk_starts.append(base)
+            self.chunks.append(data)
+            for match in pattern.finditer(data):
+                self.starts.append(base + match.start())
+                self.ends.append(base + match.end() - 1)
+                hashes.append(hash(match.group()[:-1]))
+        order = sorted(xrange(len(hashes)), key=hashes.__getitem__)
+        self.hashes = int64_array([hashes[i] for i in order])
+        self.by_hash = array('I', order)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        start = self.starts[i]
+        chunk = bisect.bisect_right(self.chunk_starts, start) - 1
+        base = self.chunk_starts[chunk]
+        return start, self.chunks[chunk][start-base:self.ends[i]-base]
+
+    def at(self, addr):
+        # (start, string) of the string covering module offset addr
+        pos = bisect.bisect_right(self.starts, addr) - 1
+        if pos >= 0 and addr <= self.ends[pos]:
+            return self[pos]
+        return None
+
+    def find(self, text):
+        # start offsets of the strings equal to text
+        out = []
+        h = hash(text)
+        pos = bisect.bisect_left(self.hashes, h)
+        while pos < len(self.hashes) and self.hashes[pos] == h:
+            start, string = self[self.by_hash[pos]]
+            if string == text:
+                out.append(start)
+            pos += 1
+        out.sort()
+        return out
+
+
+POINTER_KINDS = ('data', 'got', 'init_array', 'fini_array')
+
+POINTER_SECTION_KINDS = {
+    '.got': 1,
+    '.got.plt': 1,
+    '.init_array': 2,
+    '.fini_array': 3,
+}
+
+
+class PointerIndex(object):
+    # every relocated pointer to somewhere in the module, as parallel arrays
+    # sorted by target: the module offset pointed at, the slot holding the
+    # pointer and an index into POINTER_KINDS for the slot's section
+    def __init__(self, targets, slots, kinds):
+        # sorting the indices by integer key is much cheaper than sorting tuples
+        order = sorted(xrange(len(targets)), key=targets.__getitem__)
+        self.targets = int64_array([targets[i] for i in order])
+        self.slots = int64_array([slots[i] for i in order])
+        self.kinds = array('B', [kinds[i] for i in order])
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, i):
+        return self.targets[i], self.slots[i], POINTER_KINDS[self.kinds[i]]
+
+    def into(self, start, end):
+        # (target, slot, kind) for the pointers to [start, end)
+        lo = bisect.bisect_left(self.targets, start)
+        hi = bisect.bisect_left(self.targets, end, lo)
+        return [self[i] for i in xrange(lo, hi)]
+
+    def to(self, addr):
+        # (slot, kind) for the pointers to addr
+        return [(slot, kind) for target, slot, kind in self.into(addr, addr + 1)]
+
+
+def print_phase(stats, phase, elapsed):
+    print 'profile: %-20s %8.3fs' % (phase, elapsed)
+
+
+class LoadStats(object):
+    # where a load went: wall-clock seconds per phase, counters, and the
+    # largest buffers seen. callback(stats, phase, seconds) is called as each
+    # phase ends; with NXO64_PROFILE set the default one prints them.
+    def __init__(self, callback=None):
+        if callback is None and os.environ.get('NXO64_PROFILE'):
+            callback = print_phase
+        from collections import Counter, OrderedDict
+        self.callback = callback
+        self.times = OrderedDict()
+        self.counters = Counter()
+        self.peaks = {}
+        self._last = time.time()
+
+    def record(self, phase, elapsed):
+        self.times[phase] = self.times.get(phase, 0) + elapsed
+        if self.callback is not None:
+            self.callback(self, phase, elapsed)
+
+    def start(self):
+        self._last = time.time()
+
+    def lap(self, phase):
+        # charge the time since the last start() or lap() to phase
+        now = time.time()
+        self.record(phase, now - self._last)
+        self._last = now
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(phase, time.time() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def peak(self, name, size):
+        if size > self.peaks.get(name, 0):
+            self.peaks[name] = size
+
+    def report(self):
+        lines = ['%-24s %10.3fs' % (phase, elapsed) for phase, elapsed in self.times.items()]
+        lines += ['%-24s %10d' % (name, n) for name, n in sorted(self.counters.items())]
+        lines += ['%-24s %9.1fK' % (name, size / 1024.0) for name, size in sorted(self.peaks.items())]
+        return '\n'.join(lines)
+
+
+class NxoFileBase(object):
+    def __init__(self, f, tloc, tsize, rloc, rsize, dloc, dsize, stats=None):
+        if stats is None:
+            stats = LoadStats()
+        self.stats = stats
+        # only filled in by loads that check segment hashes
+        self.hash_mismatches = None
+        self.textoff    = tloc
+        self.textsize   = tsize
+        self.rodataoff  = rloc
+        self.rodatasize = rsize
+        self.dataoff    = dloc
+        flatsize = dloc + dsize
+
+
+        self.binfile = f
+
+        # read MOD
+        self.modoff = f.read_from('I', 4)
+
+        mod = f.read_from('4s6i', self.modoff)
+        if mod[0] != 'MOD0':
+            raise NxoException('invalid MOD0 magic')
+
+        self.dynamicoff = self.modoff + mod[1]
+        self.bssoff     = self.modoff + mod[2]
+        self.bssend     = self.modoff + mod[3]
+        self.unwindoff  = self.modoff + mod[4]
+        self.unwindend  = self.modoff + mod[5]
+        self.moduleoff  = self.modoff + mod[6]
+
+
+        self.datasize = self.bssoff - self.dataoff
+        self.bsssize = self.bssend - self.bssoff
+
+
+        self.segment_builder = builder = SegmentBuilder()
+        for off,sz,name,kind in [
+            (self.textoff, self.textsize, ".text", "CODE"),
+            (self.rodataoff, self.rodatasize, ".rodata", "CONST"),
+            (self.dataoff, self.datasize, ".data", "DATA"),
+            (self.bssoff, self.bsssize, ".bss", "BSS"),
+        ]:
+            builder.add_segment(off, sz, name, kind)
+
+        # read dynamic
+        self.armv7 = (f.read_from('Q', self.dynamicoff) > 0xFFFFFFFF or f.read_from('Q', self.dynamicoff+0x10) > 0xFFFFFFFF)
+        self.offsize = 4 if self.armv7 else 8
+
+        f.seek(self.dynamicoff)
+        self.dynamic = dynamic = {}
+        for i in MULTIPLE_DTS:
+            dynamic[i] = []
+        for i in xrange((flatsize - self.dynamicoff) / 0x10):
+            tag, val = f.read('II' if self.armv7 else 'QQ')
+            if tag == DT_NULL:
+                break
+            if tag in MULTIPLE_DTS:
+                dynamic[tag].append(val)
+            else:
+                dynamic[tag] = val
+        builder.add_section('.dynamic', self.dynamicoff, end=f.tell())
+
+        # read .dynstr
+        if DT_STRTAB in dynamic and DT_STRSZ in dynamic:
+            f.seek(dynamic[DT_STRTAB])
+            self.dynstr = f.read(dynamic[DT_STRSZ]).tobytes()
+        else:
+            self.dynstr = '\0'
+            print 'warning: no dynstr'
+
+        for startkey, szkey, name in [
+            (DT_STRTAB, DT_STRSZ, '.dynstr'),
+            (DT_INIT_ARRAY, DT_INIT_ARRAYSZ, '.init_array'),
+            (DT_FINI_ARRAY, DT_FINI_ARRAYSZ, '.fini_array'),
+            (DT_RELA, DT_RELASZ, '.rela.dyn'),
+            (DT_REL, DT_RELSZ, '.rel.dyn'),
+            (DT_JMPREL, DT_PLTRELSZ, ('.rel.plt' if self.armv7 else '.rela.plt')),
+        ]:
+            if startkey in dynamic and szkey in dynamic:
+                builder.add_section(name, dynamic[startkey], size=dynamic[szkey])
+
+        self.needed = [self.get_dynstr(i) for i in self.dynamic[DT_NEEDED]]
+
+        # MOD0 points at .eh_frame_hdr; the FDEs it indexes are only walked
+        # when someone asks for unwind_functions
+        self.unwind = None
+        if self.unwindend > self.unwindoff:
+            try:
+                self.unwind = UnwindTable(f, self.unwindoff, self.unwindend, self.offsize)
+            except (NxoException, struct.error) as e:
+                print 'warning: bad .eh_frame_hdr (%s)' % (e,)
+            else:
+                builder.add_section('.eh_frame_hdr', self.unwindoff, end=self.unwindend)
+        stats.lap('dynamic')
+
+        # the hash tables give the exact size of .dynsym
+        self.hash_table = None
+        if DT_GNU_HASH in dynamic:
+            self.hash_table = GnuHashTable(f, dynamic[DT_GNU_HASH], self.offsize)
+        elif DT_HASH in dynamic:
+            self.hash_table = SysvHashTable(f, dynamic[DT_HASH])
+        if self.hash_table is not None:
+            builder.add_section(self.hash_table.name, dynamic[DT_GNU_HASH if DT_GNU_HASH in dynamic else DT_HASH],
+                                size=self.hash_table.size)
+
+        # load .dynsym
+        symsize = 0x10 if self.armv7 else 0x18
+        if self.hash_table is not None:
+            symcount = self.hash_table.count
+        else:
+            symend = flatsize
+            if dynamic[DT_SYMTAB] < dynamic[DT_STRTAB]:
+                symend = min(symend, dynamic[DT_STRTAB] + symsize - 1)
+            symcount = max(symend - dynamic[DT_SYMTAB], 0) // symsize
+        self.symbols = symbols = SymbolTable(f.read_from(symcount * symsize, dynamic[DT_SYMTAB]), self.armv7, self.dynstr)
+        builder.add_section('.dynsym', dynamic[DT_SYMTAB], size=symbols.consumed * symsize)
+        stats.count('symbols', len(symbols))
+        stats.lap('dynsym')
+
+        self.relocation_tables = []
+        self.relocations = Relocations(self.relocation_tables, symbols)
+        self.plt_got_range = None
+        locations = set()
+        if DT_REL in dynamic:
+            locations |= self.process_relocations(f, DT_REL, dynamic[DT_REL], dynamic[DT_RELSZ])
+
+        if DT_RELA in dynamic:
+            locations |= self.process_relocations(f, DT_RELA, dynamic[DT_RELA], dynamic[DT_RELASZ])
+
+        if DT_JMPREL in dynamic:
+            pltlocations = self.process_relocations(f, DT_JMPREL, dynamic[DT_JMPREL], dynamic[DT_PLTRELSZ])
+            locations |= pltlocations
+
+            plt_got_start = min(pltlocations)
+            plt_got_end = max(pltlocations) + self.offsize
+            self.plt_got_range = (plt_got_start, plt_got_end)
+            if DT_PLTGOT in dynamic:
+                builder.add_section('.got.plt', dynamic[DT_PLTGOT], end=plt_got_end)
+
+            # try to find the ".got" which should follow the ".got.plt"
+            good = False
+            got_end = plt_got_end + self.offsize
+            while got_end in locations and (DT_INIT_ARRAY not in dynamic or got_end < dynamic[DT_INIT_ARRAY]):
+                good = True
+                got_end += self.offsize
+
+            if good:
+                builder.add_section('.got', plt_got_end, end=got_end)
+
+        stats.count('relocations', len(self.relocations))
+        stats.counters.update(self.relocation_counts())
+        stats.lap('relocations')
+
+        # the PLT scan needs all of .text, so it (and the section list that
+        # includes ".plt") waits until someone asks for it
+        self._plt_entries = None
+        self._unwind_functions = None
+        self._sections = None
+        self._section_starts = None
+        self._names = None
+        self._by_address = None
+        self._strings = None
+        self._pointers = None
+
+    @property
+    def plt_entries(self):
+        if self._plt_entries is None:
+            with self.stats.phase('plt_scan'):
+                self._plt_entries = self.scan_plt()
+            self.stats.count('plt_entries', len(self._plt_entries))
+        return self._plt_entries
+
+    @property
+    def unwind_functions(self):
+        # (starts, ends): sorted arrays of the exact bounds of every function
+        # that has unwind info
+        if self._unwind_functions is None:
+            self._unwind_functions = (array('I'), array('I'))
+            if self.unwind is not None:
+                with self.stats.phase('unwind'):
+                    try:
+                        self._unwind_functions = self.unwind.functions()
+                    except (NxoException, struct.error) as e:
+                        print 'warning: bad .eh_frame (%s)' % (e,)
+                        self.unwind.eh_frame_end = None
+            self.stats.count('unwind_functions', len(self._unwind_functions[0]))
+        return self._unwind_functions
+
+    @property
+    def sections(self):
+        if self._sections is None:
+            if self.plt_entries:
+                self.segment_builder.add_section('.plt', min(self.plt_entries)[0],
+                                                 end=max(self.plt_entries)[0] + (0xC if self.armv7 else 0x10))
+            if self.unwind_functions[0] and self.unwind.eh_frame_end > self.unwind.eh_frame:
+                self.segment_builder.add_section('.eh_frame', self.unwind.eh_frame, end=self.unwind.eh_frame_end)
+            with self.stats.phase('sections'):
+                self._sections = []
+                for start, end, name, kind in self.segment_builder.flatten():
+                    self._sections.append((start, end, name, kind))
+        return self._sections
+
+    @property
+    def strings(self):
+        # StringIndex over the .rodata sections
+        if self._strings is None:
+            with self.stats.phase('strings'):
+                self._strings = StringIndex([(start, self.binfile.read_from(end - start, start).tobytes())
+                                             for start, end, name, kind in self.sections
+                                             if name.startswith('.rodata')])
+            self.stats.count('strings', len(self._strings))
+        return self._strings
+
+    @property
+    def pointers(self):
+        # PointerIndex over the targets of relative relocations and of
+        # relocations against symbols the module defines
+        if self._pointers is None:
+            with self.stats.phase('pointers'):
+                symbols = self.symbols
+                slot_kinds = [(start, end, POINTER_SECTION_KINDS[name])
+                              for start, end, name, kind in self.sections if name in POINTER_SECTION_KINDS]
+                targets, slots, kinds = [], [], []
+                for table in self.relocation_tables:
+                    for offset, r_type, r_sym, addend in table:
+                        if r_type == R_AARCH64_RELATIVE:
+                            target = addend
+                        elif r_type in (R_AARCH64_GLOB_DAT, R_AARCH64_JUMP_SLOT, R_AARCH64_ABS64):
+                            if not symbols.shndxs[r_sym]:
+                                continue
+                            target = symbols.values[r_sym] + addend
+                        elif r_type == R_ARM_RELATIVE:
+                            target = self.binfile.read_from('I', offset)
+                        elif r_type in (R_ARM_GLOB_DAT, R_ARM_JUMP_SLOT, R_ARM_ABS32) and r_sym:
+                            if not symbols.shndxs[r_sym]:
+                                continue
+                            target = symbols.values[r_sym]
+                        else:
+                            continue
+                        slot_kind = 0
+                        for start, end, kind in slot_kinds:
+                            if start <= offset < end:
+                                slot_kind = kind
+                                break
+                        targets.append(target)
+                        slots.append(offset)
+                        kinds.append(slot_kind)
+                self._pointers = PointerIndex(targets, slots, kinds)
+            self.stats.count('pointers', len(self._pointers))
+        return self._pointers
+
+    def read_text(self):
+        # .text as a string and as an array of instruction words
+        f = self.binfile
+        f.seek(0)
+        text = f.read(self.textsize & ~3).tobytes()
+        words = array('I')
+        words.fromstring(text)
+        if sys.byteorder != 'little':
+            words.byteswap()
+        self.stats.peak('text', len(text))
+        return text, words
+
+    def find_bl_targets(self, include_b=False):
+        # sorted .text offsets called by BL (and optionally jumped to by B)
+        text, words = self.read_text()
+        if self.armv7:
+            # cond=AL only; imm24 is relative to pc+8
+            opcodes = '\xea\xeb' if include_b else '\xeb'
+            bits, pcoff = 24, 8
+        else:
+            opcodes = '\x14-\x17\x94-\x97' if include_b else '\x94-\x97'
+            bits, pcoff = 26, 0
+        # match on the top byte of every word at once
+        import re
+        hits = [m.start() for m in re.finditer('[%s]' % opcodes, text[3::4])]
+        mask = (1 << bits) - 1
+        sign = 1 << (bits - 1)
+        imms = [((words[i] & mask) ^ sign) - sign for i in hits]
+        targets = set(i * 4 + pcoff + imm * 4 for i, imm in zip(hits, imms)
+                      if self.armv7 or not 0 <= imm <= 2)
+        targets = array('I', sorted(t for t in targets if 0 <= t < self.textsize))
+        self.stats.count('bl_targets', len(targets))
+        return targets
+
+    def scan_plt(self):
+        if self.plt_got_range is None:
+            return []
+        plt_got_start, plt_got_end = self.plt_got_range
+
+        text, words = self.read_text()
+        if self.armv7:
+            # add ip, pc, #X ; add ip, ip, #Y ; ldr pc, [ip, #Z]!
+            hits = [i for i in find_words(text, '\x8f\xe2', 2) if i + 3 <= len(words)]
+            hits = [i for i in hits if (words[i] & 0xfffff000) == 0xe28fc000 and
+                    (words[i+1] & 0xfffff000) == 0xe28cc000 and (words[i+2] & 0xfffff000) == 0xe5bcf000]
+            entries = [(i * 4, i * 4 + 8 + arm_expand_imm(words[i]) + arm_expand_imm(words[i+1]) + (words[i+2] & 0xfff))
+                       for i in hits]
+        else:
+            # adrp x16, X ; ldr x17, [x16, #Y] ; add x16, x16, #Y ; br x17
+            hits = [i - 3 for i in find_words(text, struct.pack('<I', 0xD61F0220)) if i >= 3]
+            hits = [i for i in hits if (words[i] & 0x9f00001f) == 0x90000010 and (words[i+1] & 0xffe003ff) == 0xf9400211]
+            entries = [((i * 4), ((i * 4) & ~0xFFF) + ((((words[i] >> 29) & 3) << 12) | (((words[i] >> 5) & 0x7ffff) << 14)) +
+                        (((words[i+1] >> 10) & 0xfff) << 3)) for i in hits]
+        return [(off, target) for off, target in entries if plt_got_start <= target < plt_got_end]
+
+    def process_relocations(self, f, tag, offset, size):
+        relocsize = 8 if self.armv7 else 0x18
+        table = RelocationTable(tag, f.read_from(size // relocsize * relocsize, offset), self.armv7)
+        self.relocation_tables.append(table)
+        return table.locations()
+
+    def get_dynstr(self, o):
+        return self.dynstr[o:self.dynstr.index('\0', o)]
+
+    def symbol_addresses(self, loadbase, import_base=0, import_size=8, resolve=None):
+        # where each symbol lives once loaded at loadbase. Named imports get
+        # the address resolve(name) returns or, without resolve, consecutive
+        # import_size stubs from import_base
+        symbols = self.symbols
+        resolved = [0] * len(symbols)
+        for i in xrange(1, len(symbols)):
+            if symbols.shndxs[i]:
+                resolved[i] = loadbase + symbols.values[i]
+                continue
+            name = symbols.name(i)
+            if not name:
+                continue
+            if resolve is not None:
+                resolved[i] = resolve(name)
+            else:
+                resolved[i] = import_base
+                import_base += import_size
+        return resolved
+
+    def relocated_image(self, loadbase, resolved):
+        # the image up to .bss with every relocation applied for loadbase;
+        # resolved gives the address of each symbol (see symbol_addresses)
+        image = bytearray(self.binfile.read_from(self.bssoff, 0))
+        for table in self.relocation_tables:
+            for offset, r_type, r_sym, addend in table:
+                if r_type == R_AARCH64_RELATIVE:
+                    value, fmt = loadbase + addend, '<Q'
+                elif r_type in (R_AARCH64_GLOB_DAT, R_AARCH64_JUMP_SLOT, R_AARCH64_ABS64):
+                    value, fmt = resolved[r_sym] + addend, '<Q'
+                elif r_type == R_ARM_RELATIVE:
+                    value, fmt = struct.unpack_from('<I', image, offset)[0] + loadbase, '<I'
+                elif r_type in (R_ARM_GLOB_DAT, R_ARM_JUMP_SLOT, R_ARM_ABS32) and r_sym:
+                    value, fmt = resolved[r_sym], '<I'
+                else:
+                    continue
+                if offset + 8 > len(image):
+                    # relocations in .bss grow the image
+                    image.extend('\0' * (offset + 8 - len(image)))
+                struct.pack_into(fmt, image, offset, value & (0xFFFFFFFF if fmt == '<I' else 0xFFFFFFFFFFFFFFFF))
+        self.stats.peak('relocated_image', len(image))
+        return image
+
+    def relocation_names(self):
+        # R_* name of each relocation type for this architecture
+        prefix = 'R_ARM_' if self.armv7 else 'R_AARCH64_'
+        return dict((v, k) for k, v in globals().items() if k.startswith(prefix))
+
+    def relocation_counts(self):
+        # how many relocations of each type, by R_* name
+        reloc_names = self.relocation_names()
+        from collections import Counter
+        relocations = Counter()
+        for table in self.relocation_tables:
+            relocations.update(table.types)
+        return dict((reloc_names.get(r_type, str(r_type)), count) for r_type, count in relocations.items())
+
+    def summary(self):
+        # a JSON-friendly description of the module
+        symbols = self.symbols
+        exports = []
+        imports = []
+        for i in xrange(1, len(symbols)):
+            name = symbols.name(i)
+            if not name:
+                continue
+            if symbols.shndxs[i]:
+                exports.append({'name': name, 'value': symbols.values[i], 'size': symbols.sizes[i],
+                                'type': symbols.infos[i] & 0xF})
+            else:
+                imports.append(name)
+        return {
+            'armv7': self.armv7,
+            'needed': self.needed,
+            'exports': exports,
+            'imports': imports,
+            'sections': [{'start': start, 'end': end, 'name': name, 'kind': kind}
+                         for start, end, name, kind in self.sections],
+            'relocations': self.relocation_counts(),
+            'plt_entries': len(self.plt_entries),
+        }
+
+    def lookup(self, name):
+        # the defined symbol called `name`, found through the module's own
+        # hash table when it has one
+        if self.hash_table is not None:
+            i = self.hash_table.lookup(self.symbols, name)
+        else:
+            if self._names is None:
+                self._names = {}
+                for i in xrange(1, len(self.symbols)):
+                    if self.symbols.shndxs[i]:
+                        self._names.setdefault(self.symbols.name(i), i)
+            i = self._names.get(name)
+        return self.symbols[i] if i else None
+
+    def symbol_at(self, addr):
+        # the defined symbol covering module offset `addr`
+        if self._by_address is None:
+            symbols = self.symbols
+            order = sorted((i for i in xrange(1, len(symbols)) if symbols.shndxs[i]), key=symbols.values.__getitem__)
+            self._by_address = (int64_array(symbols.values[i] for i in order), array('I', order))
+        values, order = self._by_address
+        pos = bisect.bisect_right(values, addr)
+        if pos == 0:
+            return None
+        # aliases share an address; take the first one that covers addr
+        for i in xrange(bisect.bisect_left(values, values[pos-1]), pos):
+            sym = self.symbols[order[i]]
+            if sym.value == addr or addr < sym.value + sym.size:
+                return sym
+        return None
+
+    def section_at(self, addr):
+        # the entry of self.sections covering module offset `addr`
+        sections = self.sections
+        if self._section_starts is None:
+            self._section_starts = [start for start, end, name, kind in sections]
+        pos = bisect.bisect_right(self._section_starts, addr) - 1
+        if pos >= 0 and addr < sections[pos][1]:
+            return sections[pos]
+        return None
+
+    def write_elf(self, fileobj):
+        # the module as an ELF shared object at address 0: the unrelocated
+        # image with program headers for each segment, and a section header
+        # table for self.sections (so .dynsym, .dynstr, .dynamic and the
+        # relocation tables are described as the standard sections)
+        if self.armv7:
+            ehdr, phdr, shdr = '<16sHHIIIIIHHHHHH', '<IIIIIIII', '<IIIIIIIIII'
+            machine, flags, entsize = EM_ARM, 0x05000000, 4
+        else:
+            ehdr, phdr, shdr = '<16sHHIQQQIHHHHHH', '<IIQQQQQQ', '<IIQQQQIIQQ'
+            machine, flags, entsize = EM_AARCH64, 0, 8
+        symsize = 0x10 if self.armv7 else 0x18
+        relsize = 8 if self.armv7 else 0x18
+        ehsize, phsize, shsize = [struct.calcsize(i) for i in (ehdr, phdr, shdr)]
+
+        # section headers, with .dynsym's section indices remapped to them
+        names = bytearray('\0')
+        headers = [(0, SHT_NULL, 0, 0, 0, 0, 0, 0, 0, 0)]
+        index = {}
+        dynamic_size = 0
+        for start, end, name, kind in self.sections:
+            index[name] = len(headers)
+            sh_type, sh_flags, sh_entsize = SHT_PROGBITS, SHF_ALLOC, 0
+            if kind == 'CODE':
+                sh_flags |= SHF_EXECINSTR
+            elif kind in ('DATA', 'BSS'):
+                sh_flags |= SHF_WRITE
+            if kind == 'BSS':
+                sh_type = SHT_NOBITS
+            elif name == '.dynsym':
+                sh_type, sh_entsize = SHT_DYNSYM, symsize
+            elif name == '.dynstr':
+                sh_type = SHT_STRTAB
+            elif name == '.dynamic':
+                sh_type, sh_entsize = SHT_DYNAMIC, 2 * entsize
+                dynamic_size = end - start
+            elif name in ('.rela.dyn', '.rela.plt'):
+                sh_type, sh_entsize = SHT_RELA, relsize
+            elif name in ('.rel.dyn', '.rel.plt'):
+                sh_type, sh_entsize = SHT_REL, relsize
+            elif name == '.hash':
+                sh_type, sh_entsize = SHT_HASH, 4
+            elif name == '.gnu.hash':
+                sh_type = SHT_GNU_HASH
+            elif name == '.init_array':
+                sh_type, sh_entsize = SHT_INIT_ARRAY, entsize
+            elif name == '.fini_array':
+                sh_type, sh_entsize = SHT_FINI_ARRAY, entsize
+            # the largest alignment (up to 16 for code, the word size otherwise)
+            # the start address actually has, so tools don't see a misaligned section
+            align = 16 if kind == 'CODE' else entsize
+            if start:
+                align = min(align, start & -start)
+            headers.append([len(names), sh_type, sh_flags, start, ELF_IMAGE_OFFSET + start, end - start,
+                            0, 0, align, sh_entsize])
+            names += name + '\0'
+        for name, link in [('.dynsym', '.dynstr'), ('.dynamic', '.dynstr'), ('.hash', '.dynsym'),
+                           ('.gnu.hash', '.dynsym'), ('.rela.dyn', '.dynsym'), ('.rela.plt', '.dynsym'),
+                           ('.rel.dyn', '.dynsym'), ('.rel.plt', '.dynsym')]:
+            if name in index and link in index:
+                headers[index[name]][6] = index[link]
+        if '.dynsym' in index:
+            # the first non-local symbol
+            headers[index['.dynsym']][7] = 1
+
+        symoff = self.dynamic[DT_SYMTAB]
+        symtab = bytearray(self.binfile.read_from(len(self.symbols) * symsize, symoff))
+        shndx_off = 14 if self.armv7 else 6
+        for i in xrange(1, len(self.symbols)):
+            if self.symbols.shndxs[i] and self.symbols.shndxs[i] < 0xff00:
+                section = self.section_at(self.symbols.values[i])
+                struct.pack_into('<H', symtab, i * symsize + shndx_off, index[section[2]] if section else 0xfff1)
+
+        shstrndx = len(headers)
+        image_end = ELF_IMAGE_OFFSET + self.bssoff
+        name = len(names)
+        names += '.shstrtab\0'
+        headers.append((name, SHT_STRTAB, 0, 0, image_end, len(names), 0, 0, 1, 0))
+        shoff = (image_end + len(names) + 7) & ~7
+
+        programs = [
+            (PT_LOAD, PF_R | PF_X, 0, self.textsize, self.textsize),
+            (PT_LOAD, PF_R, self.rodataoff, self.rodatasize, self.rodatasize),
+            (PT_LOAD, PF_R | PF_W, self.dataoff, self.datasize, self.datasize + self.bsssize),
+            (PT_DYNAMIC, PF_R | PF_W, self.dynamicoff, dynamic_size, dynamic_size),
+        ]
+        if self.unwind is not None:
+            programs.append((PT_GNU_EH_FRAME, PF_R, self.unwindoff, self.unwindend - self.unwindoff,
+                             self.unwindend - self.unwindoff))
+
+        out = bytearray(struct.pack(ehdr, '\x7fELF' + chr(1 if self.armv7 else 2) + '\x01\x01', 3, machine, 1, 0,
+                                    ehsize, shoff, flags, ehsize, phsize, len(programs), shsize, len(headers),
+                                    shstrndx))
+        for p_type, p_flags, vaddr, filesz, memsz in programs:
+            offset = ELF_IMAGE_OFFSET + vaddr
+            align = 0x1000 if p_type == PT_LOAD else entsize
+            if self.armv7:
+                out += struct.pack(phdr, p_type, offset, vaddr, vaddr, filesz, memsz, p_flags, align)
+            else:
+                out += struct.pack(phdr, p_type, p_flags, offset, vaddr, vaddr, filesz, memsz, align)
+        out += '\0' * (ELF_IMAGE_OFFSET - len(out))
+        fileobj.write(out)
+
+        image = self.binfile.read_from(self.bssoff, 0)
+        fileobj.write(image[:symoff])
+        fileobj.write(symtab)
+        fileobj.write(image[symoff + len(symtab):])
+
+        out = bytearray(names)
+        out += '\0' * (shoff - image_end - len(out))
+        for header in headers:
+            out += struct.pack(shdr, *header)
+        fileobj.write(out)
+
+
+# where the image starts in files written by write_elf
+ELF_IMAGE_OFFSET = 0x1000
+
+
+def decompress_segment(image, compressed, loc, size, end):
+    data = uncompress(compressed, uncompressed_size=size)
+    if loc + len(data) > end:
+        print 'truncating?'
+        data = memoryview(data)[:end-loc]
+    image[loc:loc+len(data)] = data
+
+
+def hash_segment(image, loc, size):
+    # hashlib releases the GIL on large buffers, so segments hash concurrently
+    import hashlib
+    return hashlib.sha256(buffer(image, loc, size)).digest()
+
+
+def decompress_and_hash(image, compressed, loc, size, end):
+    decompress_segment(image, compressed, loc, size, end)
+    return hash_segment(image, loc, size)
+
+
+NSO_SEGMENTS = ('text', 'rodata', 'data')
+
+
+class NsoFile(NxoFileBase):
+    # with verify, each segment the header flags for a hash check is hashed
+    # right after it is decompressed and compared against the SHA-256 in the
+    # header; the names of the segments that don't match end up in
+    # hash_mismatches
+    def __init__(self, fileobj, pool=None, lazy=False, stats=None, verify=False):
+        if stats is None:
+            stats = LoadStats()
+        stats.start()
+        f = BinFile(fileobj)
+        header = BufferBinFile(f.read_from(0x100, 0))
+
+        if header.read_from('4s', 0) != 'NSO0':
+            raise NxoException('Invalid NSO magic')
+
+        toff, tloc, tsize = header.read_from('III', 0x10)
+        roff, rloc, rsize = header.read_from('III', 0x20)
+        doff, dloc, dsize = header.read_from('III', 0x30)
+
+        tfilesize, rfilesize, dfilesize = header.read_from('III', 0x60)
+        bsssize = header.read_from('I', 0x3C)
+        digests = [header.read_from('32s', 0xA0 + i * 0x20) for i in xrange(3)]
+        # bits 3-5 of the flags say which segments have a hash to check
+        flags = header.read_from('I', 0xC)
+        checked = [verify and bool(flags & (8 << i)) for i in xrange(3)]
+
+        print 'load text: '
+        # decompress each segment into its place in a single preallocated image
+        image = bytearray(dloc + dsize)
+        segments = [
+            (toff, tfilesize, 0, tsize, rloc),
+            (roff, rfilesize, rloc, rsize, dloc),
+            (doff, dfilesize, dloc, dsize, len(image)),
+        ]
+        hashes = None
+        if lazy and not verify:
+            # fileobj has to stay open until every segment has been touched
+            binfile = LazyBinFile(image, f, segments)
+        else:
+            jobs = [(decompress_and_hash if check else decompress_segment,
+                     (image, f.read_from(filesize, fileoff), loc, size, end))
+                    for check, (fileoff, filesize, loc, size, end) in zip(checked, segments)]
+            if pool is None:
+                hashes = [func(*args) for func, args in jobs]
+            else:
+                # lz4 releases the GIL, so the segments decompress concurrently
+                hashes = [result.get() for result in [pool.apply_async(func, args) for func, args in jobs]]
+            binfile = BufferBinFile(image)
+        stats.peak('image', len(image))
+        stats.peak('compressed', max(tfilesize, rfilesize, dfilesize))
+        stats.lap('decompress')
+
+        super(NsoFile, self).__init__(binfile, tloc, tsize, rloc, rsize, dloc, dsize, stats)
+
+        if verify:
+            self.hash_mismatches = []
+            for name, check, digest, expected in zip(NSO_SEGMENTS, checked, hashes, digests):
+                if check and digest != expected:
+                    print 'warning: %s segment hash mismatch (%s, expected %s)' % (
+                        name, digest.encode('hex'), expected.encode('hex'))
+                    self.hash_mismatches.append(name)
+            stats.count('hash_mismatches', len(self.hash_mismatches))
+
+
+class NroFile(NxoFileBase):
+    def __init__(self, fileobj, stats=None):
+        if stats is None:
+            stats = LoadStats()
+        stats.start()
+        fileobj.seek(0)
+        image = fileobj.read()
+        f = BufferBinFile(image)
+        stats.peak('image', len(image))
+        stats.lap('read')
+
+        if f.read_from('4s', 0x10) != 'NRO0':
+            raise NxoException('Invalid NRO magic')
+
+        tloc, tsize, rloc, rsize, dloc, dsize = f.read_from('6I', 0x20)
+
+        super(NroFile, self).__init__(f, tloc, tsize, rloc, rsize, dloc, dsize, stats)
+
+
+class NxoException(Exception):
+    pass
+
+
+# bump whenever NxoFileBase gains, loses or changes parsed state, so stale
+# cache entries are never picked up
+PARSER_VERSION = 4
+
+CACHE_MAGIC = 'NXOC'
+
+# NxoFileBase attributes stored verbatim in a cache entry
+CACHED_ATTRS = (
+    'textoff', 'textsize', 'rodataoff', 'rodatasize', 'dataoff', 'modoff', 'dynamicoff',
+    'bssoff', 'bssend', 'unwindoff', 'unwindend', 'moduleoff', 'datasize', 'bsssize',
+    'armv7', 'offsize', 'dynamic', 'dynstr', 'needed', 'plt_got_range', 'hash_mismatches',
+)
+
+
+def _dump_column(column, typecode):
+    # columns are stored little-endian with a fixed item size, whatever the
+    # host's array typecodes are
+    if isinstance(column, array) and column.itemsize == struct.calcsize(typecode):
+        if sys.byteorder != 'little':
+            column = array(column.typecode, column)
+            column.byteswap()
+        return typecode, len(column), column.tostring()
+    return typecode, len(column), struct.pack('<%d%s' % (len(column), typecode), *column)
+
+
+def _load_column(buf, typecode, count):
+    if typecode == 'q':
+        if INT64_TYPECODE is None or sys.byteorder != 'little':
+            return int64_array(struct.unpack_from('<%dq' % count, buf))
+        typecode = INT64_TYPECODE
+    column = array(typecode)
+    column.fromstring(buf)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+class ParseCache(object):
+    # parsed modules on disk, keyed by the SHA-256 of the input file. Each
+    # entry is a marshalled header followed by the raw image and the symbol
+    # and relocation columns, so a hit only maps the file and copies columns.
+    # The least recently used entries are dropped once the directory is over
+    # max_size bytes.
+    def __init__(self, path, max_size=1 << 30):
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def key(self, fileobj):
+        import hashlib
+        h = hashlib.sha256('nxo64 %d python %d.%d\0' % ((PARSER_VERSION,) + sys.version_info[:2]))
+        fileobj.seek(0)
+        while True:
+            data = fileobj.read(1 << 20)
+            if not data:
+                break
+            h.update(data)
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + '.nxoc')
+
+    def get(self, key):
+        import mmap
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as fileobj:
+                mm = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            f = self.restore(mm)
+        except Exception as e:
+            print 'warning: ignoring bad cache entry %s (%s)' % (path, e)
+            mm.close()
+            self.remove(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return f
+
+    def put(self, key, f):
+        path = self.entry_path(key)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), id(f))
+        with open(tmp, 'wb') as fileobj:
+            self.dump(fileobj, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # someone else cached it first (rename can't replace on Windows)
+            self.remove(tmp)
+        self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # still mapped by someone (Windows), or already gone
+            pass
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.nxoc'):
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            self.remove(os.path.join(self.path, name))
+            total -= size
+
+    def dump(self, fileobj, f):
+        # scanning the PLT and building the section list now means a hit
+        # never needs to
+        sections = f.sections
+        f.binfile.seek(0)
+        blobs = [('image', f.binfile.read(None))]
+        columns = []
+        for attr, typecode in [('names', 'I'), ('infos', 'B'), ('others', 'B'), ('shndxs', 'H'),
+                               ('values', 'q'), ('sizes', 'q')]:
+            typecode, count, data = _dump_column(getattr(f.symbols, attr), typecode)
+            columns.append(('symbols.' + attr, typecode, count))
+            blobs.append(('symbols.' + attr, data))
+        for attr, column in zip(('starts', 'ends'), f.unwind_functions):
+            typecode, count, data = _dump_column(column, 'I')
+            columns.append(('unwind.' + attr, typecode, count))
+            blobs.append(('unwind.' + attr, data))
+        tables = []
+        for n, table in enumerate(f.relocation_tables):
+            tables.append(table.tag)
+            for attr, typecode in [('offsets', 'I' if f.armv7 else 'q'), ('types', 'I'), ('syms', 'I'),
+                                   ('addends', 'q')]:
+                if getattr(table, attr) is None:
+                    continue
+                name = 'relocations.%d.%s' % (n, attr)
+                typecode, count, data = _dump_column(getattr(table, attr), typecode)
+                columns.append((name, typecode, count))
+                blobs.append((name, data))
+
+        layout = {}
+        pos = 0
+        for name, data in blobs:
+            layout[name] = (pos, len(data))
+            pos += (len(data) + 15) & ~15
+
+        segments = []
+        for segment in f.segment_builder.segments:
+            segments.append((segment.range.start, segment.range.size, segment.name, segment.kind,
+                             [(s.range.start, s.range.size, s.name) for s in segment.sections]))
+        header = marshal.dumps({
+            'class': type(f).__name__,
+            'attrs': dict((attr, getattr(f, attr)) for attr in CACHED_ATTRS),
+            'plt_entries': f.plt_entries,
+            'sections': sections,
+            'segments': segments,
+            'symbols.consumed': f.symbols.consumed,
+            'eh_frame_end': f.unwind.eh_frame_end if f.unwind is not None else False,
+            'relocations': tables,
+            'columns': columns,
+            'layout': layout,
+        })
+        start = (8 + len(header) + 15) & ~15
+        fileobj.write(struct.pack('<4sI', CACHE_MAGIC, len(header)))
+        fileobj.write(header)
+        fileobj.write('\0' * (start - 8 - len(header)))
+        for name, data in blobs:
+            fileobj.write(data)
+            fileobj.write('\0' * (-len(data) & 15))
+
+    def restore(self, mm):
+        magic, size = struct.unpack_from('<4sI', mm, 0)
+        if magic != CACHE_MAGIC:
+            raise NxoException('invalid cache magic')
+        header = marshal.loads(mm[8:8+size])
+        start = (8 + size + 15) & ~15
+        layout = header['layout']
+
+        def blob(name):
+            off, size = layout[name]
+            return buffer(mm, start + off, size)
+
+        columns = dict((name, _load_column(blob(name), typecode, count))
+                       for name, typecode, count in header['columns'])
+
+        cls = {'NsoFile': NsoFile, 'NroFile': NroFile}[header['class']]
+        f = cls.__new__(cls)
+        for attr, value in header['attrs'].items():
+            setattr(f, attr, value)
+        # the image stays in the mapping; it lives as long as the binfile
+        f.binfile = BufferBinFile(blob('image'))
+
+        f.segment_builder = builder = SegmentBuilder()
+        for seg_start, seg_size, seg_name, kind, sections in header['segments']:
+            builder.add_segment(seg_start, seg_size, seg_name, kind)
+            for sec_start, sec_size, sec_name in sections:
+                builder.add_section(sec_name, sec_start, size=sec_size)
+
+        f.hash_table = None
+        if DT_GNU_HASH in f.dynamic:
+            f.hash_table = GnuHashTable(f.binfile, f.dynamic[DT_GNU_HASH], f.offsize)
+        elif DT_HASH in f.dynamic:
+            f.hash_table = SysvHashTable(f.binfile, f.dynamic[DT_HASH])
+
+        f.unwind = None
+        if header['eh_frame_end'] is not False:
+            f.unwind = UnwindTable(f.binfile, f.unwindoff, f.unwindend, f.offsize)
+            f.unwind.eh_frame_end = header['eh_frame_end']
+        f._unwind_functions = (columns['unwind.starts'], columns['unwind.ends'])
+
+        f.symbols = symbols = SymbolTable.__new__(SymbolTable)
+        symbols.dynstr = f.dynstr
+        symbols.consumed = header['symbols.consumed']
+        for attr in ('names', 'infos', 'others', 'shndxs', 'values', 'sizes'):
+            setattr(symbols, attr, columns['symbols.' + attr])
+
+        f.relocation_tables = []
+        for n, tag in enumerate(header['relocations']):
+            table = RelocationTable.__new__(RelocationTable)
+            table.tag = tag
+            for attr in ('offsets', 'types', 'syms', 'addends'):
+                setattr(table, attr, columns.get('relocations.%d.%s' % (n, attr)))
+            f.relocation_tables.append(table)
+        f.relocations = Relocations(f.relocation_tables, symbols)
+
+        f._plt_entries = header['plt_entries']
+        f._sections = header['sections']
+        f._section_starts = None
+        f._names = None
+        f._by_address = None
+        f._strings = None
+        f._pointers = None
+        f.stats = LoadStats()
+        return f
+
+
+def default_cache():
+    # the cache is opt-in: set NXO64_CACHE_DIR (and optionally NXO64_CACHE_SIZE,
+    # in megabytes) to turn it on for every load_nxo call
+    path = os.environ.get('NXO64_CACHE_DIR')
+    if not path:
+        return None
+    return ParseCache(path, int(os.environ.get('NXO64_CACHE_SIZE', 1024)) << 20)
+
+
+# threads for one NSO: its three segments decompress (and hash, with
+# verify) in parallel, which is what makes verifying cheap
+SEGMENT_WORKERS = 3
+
+
+def load_nxo(fileobj, workers=None, pool=None, lazy=False, cache=None, stats=None, verify=False):
+    # cache is a ParseCache, or False to bypass the one from default_cache();
+    # stats is a LoadStats to collect timings in (see f.stats); verify checks
+    # NSO segment hashes (see NsoFile) and implies a full load
+    if stats is None:
+        stats = LoadStats()
+    if cache is None:
+        cache = default_cache()
+    if not cache:
+        return parse_nxo(fileobj, workers, pool, lazy, stats, verify)
+    stats.start()
+    key = cache.key(fileobj)
+    f = cache.get(key)
+    stats.lap('cache_lookup')
+    # an entry stored by a load that didn't verify has no hash results
+    if f is not None and verify and f.hash_mismatches is None and isinstance(f, NsoFile):
+        f = None
+    if f is None:
+        f = parse_nxo(fileobj, workers, pool, lazy, stats, verify)
+        # a lazy load hasn't decompressed the image that an entry needs
+        if not lazy or verify:
+            with stats.phase('cache_store'):
+                cache.put(key, f)
+    else:
+        f.stats = stats
+        stats.peak('image', f.bssoff)
+        if verify and f.hash_mismatches:
+            print 'warning: segment hash mismatch in %s' % (', '.join(f.hash_mismatches),)
+    return f
+
+
+def parse_nxo(fileobj, workers=None, pool=None, lazy=False, stats=None, verify=False):
+    fileobj.seek(0)
+    kind = nxo_kind(fileobj.read(0x14))
+
+    if kind == 'NSO':
+        if pool is None and workers and (verify or not lazy):
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(workers)
+            try:
+                return NsoFile(fileobj, pool, stats=stats, verify=verify)
+            finally:
+                pool.close()
+        return NsoFile(fileobj, pool, lazy, stats, verify)
+    elif kind == 'NRO':
+        return NroFile(fileobj, stats)
+    else:
+        raise NxoException("not an NRO or NSO file")
+
+
+def load_nxos(fileobjs, workers=None, verify=False, cache=None):
+    # opens many files at once: one thread per file does the reading and
+    # parsing while a shared pool decompresses segments from all of them
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    loaders = ThreadPool(workers)
+    try:
+        return loaders.map(lambda fileobj: load_nxo(fileobj, pool=pool, cache=cache, verify=verify), fileobjs)
+    finally:
+        loaders.close()
+        pool.close()
+
+
+# the modules of an ExeFS, in the order the loader places them
+EXEFS_MODULES = ['rtld', 'main'] + ['subsdk%d' % i for i in xrange(10)] + ['sdk']
+
+
+class NxoSet(object):
+    # modules loaded side by side (e.g. a whole ExeFS), each at its own base,
+    # with every import bound to the first module in load order that exports
+    # it. Imports that nothing exports get import_size stubs after the last
+    # module, listed in undefined as (address, name).
+    def __init__(self, modules, loadbase=None, import_size=8):
+        if not modules:
+            raise NxoException('no modules to load')
+        self.armv7 = modules[0][1].armv7
+        if any(f.armv7 != self.armv7 for name, f in modules):
+            raise NxoException('cannot load 32-bit and 64-bit modules together')
+        if loadbase is None:
+            loadbase = 0x60000000 if self.armv7 else 0x7100000000
+
+        self.modules = []
+        for name, f in modules:
+            self.modules.append((name, f, loadbase))
+            end = loadbase + max(end for start, end, section, kind in f.sections)
+            loadbase = (end + 0xFFF) & ~0xFFF
+        # plus one entry so we don't end up on the last module's "end" symbol
+        self.import_base = loadbase + import_size
+        self.import_size = import_size
+        self.undefined = []
+        self._stubs = {}
+        self._exports = {}
+        self.resolved = [f.symbol_addresses(base, resolve=self._resolve_import) for name, f, base in self.modules]
+
+    def find_export(self, name):
+        # the address of the first definition of name, in load order
+        try:
+            return self._exports[name]
+        except KeyError:
+            pass
+        addr = None
+        for module, f, base in self.modules:
+            sym = f.lookup(name)
+            if sym is not None:
+                addr = base + sym.value
+                break
+        self._exports[name] = addr
+        return addr
+
+    def _resolve_import(self, name):
+        # the exporting module's definition, or a stub shared by every
+        # import of name that nothing exports
+        addr = self.find_export(name)
+        if addr is None:
+            addr = self._stubs.get(name)
+            if addr is None:
+                addr = self._stubs[name] = self.import_base + len(self.undefined) * self.import_size
+                self.undefined.append((addr, name))
+        return addr
+
+    def relocated_image(self, i):
+        # module i's image with its relocations bound across modules
+        name, f, base = self.modules[i]
+        return f.relocated_image(base, self.resolved[i])
+
+
+def exefs_paths(path):
+    # (name, path) of each ExeFS module in directory `path`, in load order
+    out = []
+    for name in EXEFS_MODULES:
+        full = os.path.join(path, name)
+        if os.path.isfile(full) and is_nxo(full):
+            out.append((name, full))
+    return out
+
+
+def load_exefs(path, workers=None, loadbase=None, verify=False):
+    paths = exefs_paths(path)
+    if not paths:
+        raise NxoException('no ExeFS modules in %s' % (path,))
+    fileobjs = [open(full, 'rb') for name, full in paths]
+    try:
+        nxos = load_nxos(fileobjs, workers, verify)
+    finally:
+        for fileobj in fileobjs:
+            fileobj.close()
+    return NxoSet(zip([name for name, full in paths], nxos), loadbase)
+
+
+def is_nxo(path):
+    with open(path, 'rb') as fileobj:
+        return nxo_kind(fileobj.read(0x14)) is not None
+
+
+def find_nxos(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    if is_nxo(full):
+                        yield full
+        else:
+            yield path
+
+
+def _quiet_worker():
+    # the loader prints progress, which would corrupt the JSON lines
+    sys.stdout = open(os.devnull, 'w')
+
+
+def nxo_names(paths):
+    # (path, name) for find_nxos(paths), where name is unique across the
+    # directories searched: the directory's own name and the path below it
+    # ("t1/main", "t2/main"), or just the file name for files given directly
+    for root in paths:
+        if os.path.isdir(root):
+            top = os.path.basename(os.path.abspath(root))
+            for path in find_nxos([root]):
+                yield path, os.path.join(top, os.path.relpath(path, root))
+        else:
+            yield root, os.path.basename(root)
+
+
+def write_new_file(path, write):
+    # calls write(fileobj) on path, which must not exist yet; the check is
+    # atomic, so worker processes can't clobber each other's output
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):
+                raise
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0))
+    with os.fdopen(fd, 'wb') as fileobj:
+        write(fileobj)
+
+
+def _summarize_file(job, elf_dir=None, verify=False):
+    path, name = job
+    try:
+        with open(path, 'rb') as fileobj:
+            f = load_nxo(fileobj, SEGMENT_WORKERS if verify else None, verify=verify)
+        out = f.summary()
+        if verify:
+            out['hash_mismatches'] = f.hash_mismatches
+        if elf_dir is not None:
+            out['elf'] = os.path.join(elf_dir, name + '.elf')
+            write_new_file(out['elf'], f.write_elf)
+    except Exception as e:
+        out = {'error': '%s: %s' % (type(e).__name__, e)}
+    out['path'] = path
+    import json
+    return json.dumps(out, sort_keys=True, encoding='latin-1')
+
+
+def main(argv=None):
+    import argparse, functools, multiprocessing
+    parser = argparse.ArgumentParser(description='Parse NSO/NRO files and print one JSON line per module')
+    parser.add_argument('paths', nargs='+', help='files, or directories to search for NSO/NRO files')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--elf', metavar='DIR', help='also write each module to DIR as an ELF file, named after '
+                        'its path below the directory it was found in (existing files are not overwritten)')
+    parser.add_argument('--verify', action='store_true', help='check NSO segment hashes (reported as hash_mismatches)')
+    args = parser.parse_args(argv)
+    if args.elf is not None and not os.path.isdir(args.elf):
+        os.makedirs(args.elf)
+
+    pool = multiprocessing.Pool(args.jobs, _quiet_worker)
+    try:
+        summarize = functools.partial(_summarize_file, elf_dir=args.elf, verify=args.verify)
+        for line in pool.imap_unordered(summarize, nxo_names(args.paths), 4):
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    main()